@@ -1,385 +1,289 @@
-import numpy as np
-from PIL import Image as PILImage
 import streamlit as st
 from datetime import datetime
-import pandas as pd
-import io
-from fpdf import FPDF
-from PIL import Image
-import os
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
+import queue
+import uuid
 from streamlit_drawable_canvas import st_canvas
-import base64
-from io import BytesIO
 
-# Ajout du support HEIC
-from pillow_heif import register_heif_opener
-register_heif_opener()
+import perf
+from draft_journal import DraftJournal
+from email_delivery import EMAIL_STATUS_LABELS, EmailDeliveryQueue, build_report_email, report_email_subject
+from photo_store import PhotoStore
+from photo_upload import discard_uploads, photo_uploader, uploaded_photos
+from render_jobs import RenderJobQueue
+from visit_analytics import VisitAnalytics
+from visit_history import VisitHistory
+from report_engine import (
+    OBS_IMAGE_WIDTH_MM,
+    QUALITY_PROFILES,
+    STORAGE_PROFILE,
+    STORAGE_WIDTH_MM,
+    adopt_prepared_image,
+    fix_image_rotation,
+    get_full_preview,
+    get_image_normalizer,
+    get_thumbnail,
+    is_signature_blank,
+    normalize_signature,
+    prepare_report,
+    prerender_observation,
+    prefetch_images,
+)
+
+def show_image_preview(image_file, caption, key):
+    thumbnail = get_thumbnail(image_file, on_error=st.error)
+    if thumbnail is not None:
+        st.image(thumbnail.data, caption=caption)
+    if st.toggle("Taille réelle", key=key):
+        full_image = get_full_preview(image_file, on_error=st.error)
+        if full_image is not None:
+            st.image(full_image.data, caption=caption, use_column_width=True)
+
+def prefetch_uploads(files):
+    # Les photos préparées par le navigateur sont déjà la version stockée : seules les autres
+    # (HEIC hors Safari) sont normalisées en arrière-plan
+    pending = []
+    for f in files:
+        if f is None:
+            continue
+        if not (f.prepared and adopt_prepared_image(f.getvalue(), f.width, f.height)):
+            pending.append(f)
+    prefetch_images(pending, STORAGE_WIDTH_MM, STORAGE_PROFILE)
+
+def stored_version(image_file):
+    # Version redressée et réduite d'un téléversement ; la photo principale et les photos
+    # d'observation en partagent la source, ce qui permet au PDF de dédupliquer une photo réutilisée
+    return fix_image_rotation(image_file.getvalue(), STORAGE_WIDTH_MM, STORAGE_PROFILE, on_error=st.error)
+
+def store_photos(files, profile):
+    # Conserve une version réduite des photos plutôt que les fichiers d'origine
+    keys = []
+    for f in files or []:
+        stored = stored_version(f)
+        if stored is not None:
+            keys.append(st.session_state.photo_store.add(stored.data))
+            prefetch_images([stored.data], OBS_IMAGE_WIDTH_MM, profile)
+    return keys
+
+def resolve_photos(obs):
+    # Observation telle qu'attendue par le moteur de rapport : photos en octets
+    return dict(obs, photos=[st.session_state.photo_store.get(key) for key in obs['photos']])
+
+def release_photos(keys):
+    for key in keys:
+        st.session_state.photo_store.release(key)
+
+@st.cache_resource(show_spinner=False)
+def get_draft_journal():
+    return DraftJournal()
+
+@st.cache_resource(show_spinner=False)
+def get_visit_history():
+    return VisitHistory()
+
+@st.cache_resource(show_spinner=False)
+def get_visit_analytics():
+    return VisitAnalytics()
+
+def history_thumbnails(observations, main_image_data):
+    # Vignettes de la photo principale (-1) et des photos de chaque observation
+    thumbnails = []
+    for obs_idx, photos in [(-1, [main_image_data] if main_image_data else [])] + \
+            [(idx, obs['photos']) for idx, obs in enumerate(observations)]:
+        for position, photo in enumerate(photos):
+            thumbnail = get_thumbnail(photo)
+            if thumbnail is not None:
+                thumbnails.append((obs_idx, position, thumbnail.data))
+    return thumbnails
+
+def journal_fields(fields):
+    # N'écrit que les champs modifiés depuis le run précédent : coût constant par action
+    journaled = st.session_state.journaled_fields
+    if not journaled and not fields.get("building_code"):
+        return
+    for name, value in fields.items():
+        if journaled.get(name) != value:
+            get_draft_journal().record_field(st.session_state.draft_id, name, value)
+            journaled[name] = value
+
+def journal_observation(obs):
+    photos = {key: st.session_state.photo_store.get(key) for key in obs['photos']}
+    get_draft_journal().record_observation(st.session_state.draft_id, obs, photos)
+
+def restore_draft(draft_id):
+    journal = get_draft_journal()
+    fields, observations = journal.load_draft(draft_id)
+    # Le brouillon de la session (déjà journalisé dès la saisie du code) est remplacé : sans cela il
+    # serait proposé, vide, à la prochaine session sur cet immeuble
+    if st.session_state.draft_id != draft_id:
+        journal.discard(st.session_state.draft_id)
+    for name, value in fields.items():
+        st.session_state[name] = datetime.strptime(value, "%Y-%m-%d").date() if name == "visit_date" else value
+    release_photos([key for obs in st.session_state.get('observations', []) for key in obs['photos']])
+    restored = []
+    for obs in observations:
+        photo_keys = []
+        for key in obs['photos']:
+            data = journal.get_photo(key)
+            if data is not None:
+                photo_keys.append(st.session_state.photo_store.add(data))
+        restored.append(dict(obs, photos=photo_keys))
+    st.session_state.observations = restored
+    st.session_state.draft_id = draft_id
+    st.session_state.journaled_fields = dict(fields)
 
 if 'editing_idx' not in st.session_state:
     st.session_state.editing_idx = None
 
-def fix_image_rotation(image_data):
-   try:
-       img = Image.open(BytesIO(image_data))
-       
-       # Si c'est une image HEIC, elle est déjà convertie en PIL Image par pillow-heif
-       
-       try:
-           exif = img._getexif()
-           if exif is not None:
-               orientation = exif.get(274)  # 274 est le tag pour l'orientation
-               if orientation == 3:
-                   img = img.rotate(180, expand=True)
-               elif orientation == 6:
-                   img = img.rotate(270, expand=True)
-               elif orientation == 8:
-                   img = img.rotate(90, expand=True)
-       except:
-           if img.width < img.height:
-               img = img.rotate(270, expand=True)
-       
-       # Conversion en JPEG pour la compatibilité PDF
-       output_buffer = BytesIO()
-       if img.mode in ('RGBA', 'LA'):
-           background = Image.new(img.mode[:-1], img.size, 'white')
-           background.paste(img, img.split()[-1])
-           img = background
-       img.convert('RGB').save(output_buffer, format='JPEG', quality=85)
-       return output_buffer.getvalue()
-   except Exception as e:
-       st.error(f"Erreur lors du traitement de l'image : {str(e)}")
-       return None
+if 'draft_id' not in st.session_state:
+    st.session_state.draft_id = uuid.uuid4().hex
+    st.session_state.journaled_fields = {}
+
+if 'visit_date' not in st.session_state:
+    st.session_state.visit_date = datetime.now().date()
+
+if 'photo_store' not in st.session_state:
+    st.session_state.photo_store = PhotoStore()
 
 # Configuration de la page
 st.set_page_config(page_title="Visite de Copropriété ORPI", layout="wide")
 
-def clean_text_for_pdf(text):
-    text = str(text)
-    # Caractères spéciaux et leurs remplacements
-    replacements = {
-        "✅": "+",
-        "❌": "-",
-        "'": "'",
-        "'": "'",
-        """: '"',
-        """: '"',
-        "é": "e",
-        "è": "e",
-        "à": "a",
-        "ê": "e",
-        "û": "u",
-        "ô": "o",
-        "î": "i",
-        "ï": "i",
-        "ë": "e",
-        "ü": "u",
-        "ç": "c",
-        "œ": "oe",
-        "æ": "ae",
-        "â": "a",
-        "É": "E",
-        "È": "E",
-        "À": "A",
-        "Ê": "E",
-        "Û": "U",
-        "Ô": "O",
-        "Î": "I",
-        "Ï": "I",
-        "Ë": "E",
-        "Ü": "U",
-        "Ç": "C",
-        "Â": "A",
-        "…": "...",
-        "—": "-",
-        "–": "-",
-        "'": "'",
-        "°": " degres ",
-        "²": "2",
-        "€": "EUR",
-        "\u2019": "'",  # apostrophe courbe
-        "\u2018": "'",  # autre apostrophe
-        "\u2013": "-",  # tiret demi-cadratin
-        "\u2014": "-",  # tiret cadratin
-        "\u2026": "...", # points de suspension
-    }
-    
-    for old, new in replacements.items():
-        text = text.replace(old, new)
-    
-    # Supprimer tous les autres caractères non-ASCII qui pourraient causer des problèmes
-    text = ''.join(char if ord(char) < 128 else ' ' for char in text)
-    return text
+@st.cache_resource(show_spinner=False)
+def get_email_queue():
+    return EmailDeliveryQueue(dict(st.secrets["email"]))
 
-def send_pdf_by_email(pdf_content, date, address):
-    try:
-        if redacteur == "David SAINT-GERMAIN":
-            recipient_email = "dsaintgermain@orpi.com"
-        elif redacteur == "Elodie BONNAY":
-            recipient_email = "ebonnay@orpi.com"
-        else:  # Samuel KITA test
-            recipient_email = "skita@orpi.com"
-        
-        msg = MIMEMultipart()
-        msg['From'] = st.secrets["email"]["sender"]
-        msg['To'] = recipient_email
-        
-        address_clean = clean_text_for_pdf(address)
-        msg['Subject'] = f"Rapport de visite - {address_clean} - {date}"
-        
-        body = f"""
-        Bonjour,
+# Intervalle d'actualisation de l'avancement pendant la génération d'un rapport (secondes)
+RENDER_POLL_SECONDS = 1.0
 
-        Veuillez trouver ci-joint le rapport de la visite effectuee le {date} a l'adresse : {address_clean}.
+@st.cache_resource(show_spinner=False)
+def get_render_queue():
+    return RenderJobQueue()
 
-        Cordialement,
-        Service Syndic ORPI
-        """
-        msg.attach(MIMEText(body, 'plain', 'utf-8'))
-        
-        pdf_attachment = MIMEApplication(pdf_content, _subtype='pdf')
-        pdf_attachment.add_header('Content-Disposition', 'attachment', 
-                                filename=f'rapport_visite_{date}.pdf')
-        msg.attach(pdf_attachment)
-        
-        with smtplib.SMTP_SSL(st.secrets["email"]["smtp_server"], 
-                             st.secrets["email"]["smtp_port"]) as server:
-            server.login(st.secrets["email"]["username"], 
-                        st.secrets["email"]["password"])
-            server.send_message(msg)
-        return True
+def report_delivery(data, observations, main_image_data, draft_id, trace_id):
+    # Suite du rapport, appelée par la file de rendu dans ce processus dès que le PDF est prêt,
+    # même si la session a disparu entre-temps (téléphone en veille, onglet fermé). Ressources et
+    # secrets sont résolus ici, dans le script : le rappel ne touche plus à la session
+    history, analytics, journal = get_visit_history(), get_visit_analytics(), get_draft_journal()
+    try:
+        email_queue, sender, email_error = get_email_queue(), st.secrets["email"]["sender"], None
     except Exception as e:
-        st.error(f"Erreur lors de l'envoi de l'email : {str(e)}")
-        return False
-
-def create_pdf(data, main_image_file, observations, signature_image=None):
-   class PDF(FPDF):
-       def header(self):
-           self.set_fill_color(227, 31, 43)
-           self.rect(10, 10, 40, 15, 'F')  # Width changée de 30 à 40
-           self.set_text_color(255, 255, 255)
-           self.set_font('Arial', 'B', 12)
-           self.text(12, 20, 'ORPI Adimmo')  # Position X ajustée de 15 à 12
-           
-           self.set_text_color(0, 0, 0)
-           self.set_font('Arial', 'B', 16)
-           self.cell(0, 10, 'RAPPORT DE VISITE', 0, 1, 'C')
-           self.ln(10)
-       
-       def footer(self):
-           self.set_y(-15)
-           self.set_font('Arial', 'I', 8)
-           self.set_text_color(128, 128, 128)
-           self.cell(0, 10, f'Page {self.page_no()}/{{nb}}', 0, 0, 'C')
-
-   pdf = PDF()
-   pdf.alias_nb_pages()
-   pdf.add_page()
-   
-   # Informations principales
-   pdf.set_fill_color(240, 240, 240)
-   pdf.rect(10, 40, 190, 70, 'F')  # Hauteur augmentée pour personnes présentes
-   pdf.set_font('Arial', 'B', 12)
-   pdf.set_xy(15, 45)
-   
-   col_width = 90
-   line_height = 8
-   
-   # Mise en page en colonnes
-   pdf.set_font('Arial', 'B', 10)
-   pdf.cell(25, line_height, 'Date:', 0, 0)
-   pdf.set_font('Arial', '', 10)
-   pdf.cell(65, line_height, f"{data['date']}", 0, 0)
-   
-   pdf.set_font('Arial', 'B', 10)
-   pdf.cell(35, line_height, 'Rédacteur:', 0, 0)
-   pdf.set_font('Arial', '', 10)
-   pdf.cell(55, line_height, f"{data['redacteur']}", 0, 1)
-   
-   pdf.set_x(15)
-   pdf.set_font('Arial', 'B', 10)
-   pdf.cell(25, line_height, 'Adresse:', 0, 0)
-   pdf.set_font('Arial', '', 10)
-   pdf.cell(65, line_height, f"{data['address']}", 0, 1)
-   
-   # Heure d'arrivée
-   pdf.set_x(15)
-   pdf.set_font('Arial', 'B', 10)
-   pdf.cell(35, line_height, "Heure d'arrivée:", 0, 0)
-   pdf.set_font('Arial', '', 10)
-   pdf.cell(65, line_height, f"{data['arrival_time']}", 0, 1)
-   
-   # Heure de départ
-   pdf.set_x(15)
-   pdf.set_font('Arial', 'B', 10)
-   pdf.cell(35, line_height, "Heure de départ:", 0, 0)
-   pdf.set_font('Arial', '', 10)
-   pdf.cell(65, line_height, f"{data['departure_time']}", 0, 1)
-   
-   pdf.set_x(15)
-   pdf.set_font('Arial', 'B', 10)
-   pdf.cell(25, line_height, 'Code:', 0, 0)
-   pdf.set_font('Arial', '', 10)
-   pdf.cell(65, line_height, f"{data['building_code']}", 0, 1)
-
-   # Ajout des personnes présentes
-   if data.get('personnes_presentes'):  # Vérifie si le champ n'est pas vide
-       pdf.set_x(15)
-       pdf.set_font('Arial', 'B', 10)
-       pdf.cell(45, line_height, 'Personnes présentes:', 0, 0)
-       pdf.set_font('Arial', '', 10)
-       pdf.multi_cell(0, line_height, f"{data['personnes_presentes']}")
-   
-   # Image principale
-   if main_image_file is not None:
-       temp_image_path = "temp_main_image.jpg"
-       try:
-           # Corriger la rotation
-           corrected_image = fix_image_rotation(main_image_file.getvalue())
-           with open(temp_image_path, "wb") as f:
-               f.write(corrected_image)
-           img = Image.open(temp_image_path)
-           img_w, img_h = img.size
-           aspect = img_h / img_w
-           width = 190
-           height = width * aspect
-           pdf.image(temp_image_path, x=10, y=120, w=width, h=height)  # Y ajusté pour tenir compte des personnes présentes
-       finally:
-           if os.path.exists(temp_image_path):
-               os.remove(temp_image_path)
-   
-   # Observations
-   pdf.add_page()
-   pdf.set_font('Arial', 'B', 14)
-   pdf.set_fill_color(227, 31, 43)
-   pdf.set_text_color(255, 255, 255)
-   pdf.cell(0, 10, 'OBSERVATIONS', 1, 1, 'C', True)
-   pdf.set_text_color(0, 0, 0)
-   
-   for idx, obs in enumerate(observations):
-       # Espacement entre les observations
-       pdf.ln(20)  # Augmentation de l'espacement entre les observations
-       
-       # Cadre gris clair pour chaque observation
-       pdf.set_fill_color(245, 245, 245)
-       start_y = pdf.get_y()
-       pdf.rect(10, start_y, 190, 10, 'F')
-       
-       # En-tête de l'observation
-       pdf.set_font('Arial', 'B', 12)
-       obs_type_clean = clean_text_for_pdf(obs['type'])
-       obs_type = "Positive" if "Positive" in obs_type_clean else "A améliorer"  # Changé "Negative" en "A améliorer"
-       if obs_type == "Positive":
-           header_color = (0, 150, 0)  # Vert pour positif
-       else:
-           header_color = (200, 0, 0)  # Rouge pour négatif
-       
-       pdf.set_text_color(*header_color)
-       pdf.set_xy(15, start_y + 2)
-       pdf.cell(0, 8, f"Observation {idx + 1} - {obs_type}", 0, 1, 'L')
-       
-       # Titre "Description :"
-       pdf.ln(8)
-       pdf.set_text_color(0, 0, 0)
-       pdf.set_font('Arial', 'B', 11)
-       pdf.cell(0, 8, "Description :", 0, 1, 'L')
-       
-       # Contenu de la description
-       pdf.set_text_color(0, 0, 0)
-       pdf.set_font('Arial', '', 10)
-       description_clean = clean_text_for_pdf(obs['description'])
-       pdf.multi_cell(0, 7, description_clean)
-       
-       # Action à mener (si elle existe)
-       if obs.get('action'):
-           pdf.ln(8)
-           pdf.set_text_color(0, 0, 0)
-           pdf.set_font('Arial', 'B', 11)
-           pdf.cell(0, 8, "Action à mener :", 0, 1, 'L')
-           
-           pdf.set_font('Arial', '', 10)
-           action_clean = clean_text_for_pdf(obs['action'])
-           pdf.multi_cell(0, 7, action_clean)
-       
-       # Espacement avant les photos
-       pdf.ln(8)
-       
-       # Photos de l'observation
-       if obs['photos']:  # Changé de 'photo' à 'photos'
-           pdf.set_font('Arial', 'B', 11)
-           pdf.cell(0, 8, "Photos :", 0, 1, 'L')
-           pdf.ln(2)
-           
-           for photo_idx, photo in enumerate(obs['photos']):
-               temp_obs_path = f"temp_obs_{idx}_{photo_idx}.jpg"
-               try:
-                   corrected_image = fix_image_rotation(photo.getvalue())
-                   with open(temp_obs_path, "wb") as f:
-                       f.write(corrected_image)
-                   current_y = pdf.get_y()
-                   if current_y > 200:
-                       pdf.add_page()
-                       current_y = pdf.get_y()
-                   pdf.image(temp_obs_path, x=10, y=current_y, w=100)
-                   pdf.set_y(current_y + 190)
-                   pdf.ln(20)
-               finally:
-                   if os.path.exists(temp_obs_path):
-                       os.remove(temp_obs_path)
-
-       # Nouvelle page si nécessaire
-       if pdf.get_y() > 250:
-           pdf.add_page()
-
-   # Page de signature
-   pdf.add_page()
-   pdf.set_font('Arial', 'B', 12)
-   pdf.cell(0, 10, "VALIDATION DU RAPPORT", 0, 1, 'C')
-   pdf.ln(5)
-   
-   pdf.set_font('Arial', 'B', 11)
-   pdf.cell(0, 10, data['redacteur'], 0, 1, 'C')
-   pdf.set_font('Arial', '', 10)
-   pdf.cell(0, 5, "Gestionnaire de copropriété", 0, 1, 'C')
-   
-   if signature_image is not None:
-       temp_sig_path = "temp_signature.png"
-       try:
-           with open(temp_sig_path, "wb") as f:
-               f.write(signature_image)
-           pdf.image(temp_sig_path, x=60, y=pdf.get_y() + 10, w=90)
-       finally:
-           if os.path.exists(temp_sig_path):
-               os.remove(temp_sig_path)
-   
-   return pdf
-    
-# Titre
-st.title("📋 Visite de Copropriété ORPI")
-st.markdown("---")
+        email_queue, sender, email_error = None, None, str(e)
+    visit_observations = [dict(obs, photos=[]) for obs in observations]
 
-# Création des colonnes
-col1, col2 = st.columns(2)
+    def deliver(result):
+        pdf_output = result["pdf"]
+        outcome = {"warnings": [], "email_error": email_error, "message_id": None}
+        # Même trace que la génération : soumission, processus de calcul et envoi se lisent ensemble
+        with perf.trace("report.deliver", trace_id=trace_id):
+            try:
+                thumbnails = history_thumbnails(observations, main_image_data)
+                with perf.span("history.record", bytes_in=len(pdf_output)):
+                    history.record_visit(data, visit_observations, pdf_output, thumbnails)
+            except Exception as e:
+                outcome["warnings"].append(f"Le rapport n'a pas pu être ajouté à l'historique : {str(e)}")
+            try:
+                with perf.span("analytics.record"):
+                    analytics.record_visit(data, visit_observations)
+            except Exception as e:
+                outcome["warnings"].append(f"La visite n'a pas pu être ajoutée au tableau de bord : {str(e)}")
 
-with col1:
-    st.subheader("📝 Informations générales")
-    
-    date = st.date_input("Date de la visite", datetime.now(), format="DD/MM/YYYY")
-    address = st.text_input("Adresse")
-    redacteur = st.selectbox("Rédacteur", ["David SAINT-GERMAIN", "Elodie BONNAY", "Samuel KITA test"])
-    personnes_presentes = st.text_area("Personnes présentes")  # Ajout de ce champ
-    arrival_time = st.text_input("Heure d'arrivée (ex: 09h00)")
-    building_code = st.text_input("Code Immeuble")
-    
-    main_image = st.file_uploader("Photo principale de la copropriété", 
-    type=['png', 'jpg', 'jpeg', 'heic', 'HEIC'])
-if main_image:
-    st.image(main_image, caption="Photo principale", use_column_width=True)
+            if email_queue is not None:
+                date, address = data["date"].strftime('%Y-%m-%d'), data["address"]
+                try:
+                    with perf.span("email.enqueue", bytes_in=len(pdf_output)):
+                        # Le PDF est partagé tel quel avec le téléchargement et l'historique ; aucune copie ici
+                        outcome["message_id"] = email_queue.submit(
+                            lambda: build_report_email(pdf_output, date, address, data["redacteur"], sender),
+                            report_email_subject(date, address),
+                        )
+                except Exception as e:
+                    outcome["email_error"] = str(e)
+        if outcome["message_id"]:
+            # Rapport parti : le brouillon est clos
+            journal.finalize(draft_id)
+        return outcome
+
+    return deliver
 
-    # Ajout du canvas de signature
+def show_report(render_job, job):
+    # Tâche terminée : historique, email et brouillon ont déjà été traités par la file de rendu,
+    # la session n'en affiche que le résultat et le lien de téléchargement
+    result = job["result"]
+    delivery = job.get("delivery") or {}
+    for error in result["errors"]:
+        st.error(error)
+    if job.get("error"):
+        st.error(f"Erreur lors de l'envoi du rapport : {job['error']}")
+    for warning in delivery.get("warnings", []):
+        st.warning(warning)
+    if delivery.get("email_error"):
+        st.error(f"Erreur lors de l'envoi de l'email : {delivery['email_error']}")
+    if delivery.get("message_id"):
+        st.session_state.email_deliveries.append(delivery["message_id"])
+        # Brouillon clos : la suite de la session repart sur un nouveau
+        if st.session_state.draft_id == render_job["draft_id"]:
+            st.session_state.draft_id = uuid.uuid4().hex
+            st.session_state.journaled_fields = {}
+        st.success("✅ PDF généré ! L'envoi par email se poursuit en arrière-plan.")
+    if result["duplicate_images"]:
+        st.caption(f"{result['duplicate_images']} image(s) en double intégrée(s) une seule fois dans le PDF.")
+    st.session_state.report_download = {
+        "data": result["pdf"],
+        "file_name": f"rapport_visite_{render_job['data']['date'].strftime('%Y%m%d')}.pdf",
+    }
+    st.session_state.last_perf_trace = render_job["perf_trace"]
+
+@st.fragment(run_every=RENDER_POLL_SECONDS)
+def render_progress(job_id):
+    # Seul ce fragment est relancé pendant la génération : le reste de la page (et la saisie
+    # en cours) n'est pas touché ; la page entière n'est relancée qu'à la fin de la tâche
+    render_queue = get_render_queue()
+    job = render_queue.status(job_id)
+    if job.get("state") not in ("pending", "running"):
+        st.rerun()
+    if job["state"] == "pending":
+        label = f"En attente d'un processus libre ({job['position']} rapport(s) avant le vôtre)..."
+    else:
+        label = f"Mise en page : {job['done']}/{job['total']} observation(s)"
+    st.progress(job["done"] / job["total"] if job["total"] else 0.0, text=label)
+    st.button("Annuler la génération", use_container_width=True, on_click=render_queue.cancel, args=(job_id,))
+
+def set_editing(idx):
+    if st.session_state.editing_idx is not None:
+        # Le formulaire d'édition quitte la page : ses photos téléversées aussi
+        discard_uploads(f"edit_photos_{st.session_state.editing_idx}")
+    st.session_state.editing_idx = idx
+
+def delete_observation(idx):
+    deleted = st.session_state.observations.pop(idx)
+    release_photos(deleted['photos'])
+    get_draft_journal().delete_observation(st.session_state.draft_id, deleted['id'])
+
+def clear_signature():
+    st.session_state.signature = None
+
+def save_observation(idx, quality_profile):
+    # Callback de "Enregistrer" : exécuté avant le rerun du fragment, qui affiche directement
+    # l'observation modifiée sans second rerun
+    obs = st.session_state.observations[idx]
+    new_photos = uploaded_photos(f"edit_photos_{idx}")
+    if new_photos:
+        # Les anciennes photos remplacées sont libérées
+        release_photos(obs['photos'])
+    st.session_state.observations[idx] = {
+        "id": obs['id'],
+        "type": st.session_state[f"edit_type_{idx}"],
+        "description": st.session_state[f"edit_desc_{idx}"],
+        "photos": store_photos(new_photos, quality_profile) if new_photos else obs['photos'],
+        "action": st.session_state[f"edit_action_{idx}"]
+    }
+    journal_observation(st.session_state.observations[idx])
+    prerender_observation(resolve_photos(st.session_state.observations[idx]), quality_profile)
+    set_editing(None)
+
+# Signature, formulaire et liste des observations sont des fragments : une interaction
+# n'y relance que la section concernée, pas toute la page
+@st.fragment
+def signature_area():
     st.markdown("### ✍️ Signature")
     signature_canvas = st_canvas(
         stroke_width=2,
@@ -391,23 +295,18 @@ if main_image:
         key="signature",
     )
     
-    if st.button("Effacer la signature"):
-        st.session_state.signature = None
-        st.experimental_rerun()
+    st.button("Effacer la signature", on_click=clear_signature)
+    return signature_canvas
 
-with col2:
-    st.subheader("🔍 Observations")
-    
-    if 'observations' not in st.session_state:
-        st.session_state.observations = []
-    
-    if 'form_key' not in st.session_state:
-        st.session_state.form_key = 0
-    
+@st.fragment
+def observation_form(quality_profile):
     with st.form(f"observation_form_{st.session_state.form_key}"):
         obs_type = st.radio("Type d'observation", ["✅ Positive", "❌ A améliorer"])
         description = st.text_area("Description")
-        photos = st.file_uploader("Photos de l'observation (maximum 3)", type=['png', 'jpg', 'jpeg', 'heic', 'HEIC'], accept_multiple_files=True)
+        photos_key = f"observation_photos_{st.session_state.form_key}"
+        photos = photo_uploader("Photos de l'observation (maximum 3)", photos_key, max_files=3)
+        if photos:
+            prefetch_uploads(photos)
         if photos and len(photos) > 3:
             st.error("Vous ne pouvez pas ajouter plus de 3 photos par observation")
         
@@ -417,87 +316,154 @@ with col2:
         if submit_button:
             if description:
                 if not photos or len(photos) <= 3:
-                    st.session_state.observations.append({
+                    new_obs = {
+                        "id": uuid.uuid4().hex,
                         "type": obs_type,
                         "description": description,
-                        "photos": photos,
+                        "photos": store_photos(photos, quality_profile),
                         "action": action
-                    })
+                    }
+                    st.session_state.observations.append(new_obs)
+                    journal_observation(new_obs)
+                    prerender_observation(resolve_photos(new_obs), quality_profile)
                     st.success("Observation ajoutée avec succès!")
+                    discard_uploads(photos_key)
                     st.session_state.form_key += 1
-                    st.experimental_rerun()
+                    # La liste des observations est un autre fragment : toute la page est relancée
+                    st.rerun()
                 else:
                     st.error("Veuillez sélectionner au maximum 3 photos")
             else:
                 st.error("Veuillez ajouter une description à votre observation.")
 
+@st.fragment
+def observation_list(quality_profile):
     if st.session_state.observations:
         st.markdown("### 📋 Liste des observations")
         for idx, obs in enumerate(st.session_state.observations):
             with st.expander(f"Observation {idx + 1} - {obs['type']}"):
                 if st.session_state.editing_idx == idx:
-                    # Mode édition
-                    new_type = st.radio(
-                        "Type d'observation", 
-                        ["✅ Positive", "❌ A améliorer"],
-                        index=0 if "Positive" in obs['type'] else 1,
-                        key=f"edit_type_{idx}"
-                    )
-                    new_description = st.text_area(
-                        "Description",
-                        value=obs['description'],
-                        key=f"edit_desc_{idx}"
-                    )
-                    new_action = st.text_area(
-                        "Action à mener (facultatif)",
-                        value=obs.get('action', ''),
-                        key=f"edit_action_{idx}"
-                    )
-                    new_photos = st.file_uploader(
-                        "Nouvelles photos (maximum 3)",
-                        type=['png', 'jpg', 'jpeg', 'heic', 'HEIC'],
-                        accept_multiple_files=True,
-                        key=f"edit_photos_{idx}"
-                    )
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.button("Enregistrer", key=f"save_{idx}"):
-                            st.session_state.observations[idx] = {
-                                "type": new_type,
-                                "description": new_description,
-                                "photos": new_photos if new_photos else obs['photos'],
-                                "action": new_action
-                            }
-                            st.session_state.editing_idx = None
-                            st.experimental_rerun()
-                    with col2:
-                        if st.button("Annuler", key=f"cancel_{idx}"):
-                            st.session_state.editing_idx = None
-                            st.experimental_rerun()
+                    # Mode édition, dans un formulaire : rien n'est relancé avant "Enregistrer" ou "Annuler"
+                    with st.form(f"edit_form_{idx}"):
+                        st.radio(
+                            "Type d'observation", 
+                            ["✅ Positive", "❌ A améliorer"],
+                            index=0 if "Positive" in obs['type'] else 1,
+                            key=f"edit_type_{idx}"
+                        )
+                        st.text_area(
+                            "Description",
+                            value=obs['description'],
+                            key=f"edit_desc_{idx}"
+                        )
+                        st.text_area(
+                            "Action à mener (facultatif)",
+                            value=obs.get('action', ''),
+                            key=f"edit_action_{idx}"
+                        )
+                        photo_uploader(
+                            "Nouvelles photos (maximum 3)",
+                            f"edit_photos_{idx}",
+                            max_files=3
+                        )
+                        
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            st.form_submit_button("Enregistrer", on_click=save_observation,
+                                                  args=(idx, quality_profile))
+                        with col2:
+                            st.form_submit_button("Annuler", on_click=set_editing, args=(None,))
                 else:
                     # Mode affichage
                     st.write("Description :", obs["description"])
                     if obs.get('action'):
                         st.write("Action à mener :", obs["action"])
                     if obs["photos"]:
-                        for photo in obs["photos"]:
-                            st.image(photo, caption=f"Photo observation {idx + 1}")
+                        for photo_idx, photo_key in enumerate(obs["photos"]):
+                            show_image_preview(st.session_state.photo_store.get(photo_key),
+                                               f"Photo observation {idx + 1}", f"full_obs_{idx}_{photo_idx}")
                     
+                    # Callbacks exécutés avant le rerun : un seul rerun par clic au lieu de deux
                     col1, col2 = st.columns(2)
                     with col1:
-                        if st.button("Modifier", key=f"mod_{idx}"):
-                            st.session_state.editing_idx = idx
-                            st.experimental_rerun()
+                        st.button("Modifier", key=f"mod_{idx}", on_click=set_editing, args=(idx,))
                     with col2:
-                        if st.button("Supprimer", key=f"del_{idx}"):
-                            st.session_state.observations.pop(idx)
-                            st.experimental_rerun()
+                        st.button("Supprimer", key=f"del_{idx}", on_click=delete_observation, args=(idx,))
     else:
         st.info("Aucune observation ajoutée pour le moment.")
 
+# Restauration demandée au run précédent : appliquée avant la création des widgets
+if 'restore_draft_id' in st.session_state:
+    restore_draft(st.session_state.pop('restore_draft_id'))
+
+# Titre
+st.title("📋 Visite de Copropriété ORPI")
+st.markdown("---")
+
+# Création des colonnes
+col1, col2 = st.columns(2)
+
+with col1:
+    st.subheader("📝 Informations générales")
+    
+    date = st.date_input("Date de la visite", format="DD/MM/YYYY", key="visit_date")
+    address = st.text_input("Adresse", key="address")
+    redacteur = st.selectbox("Rédacteur", ["David SAINT-GERMAIN", "Elodie BONNAY", "Samuel KITA test"], key="redacteur")
+    personnes_presentes = st.text_area("Personnes présentes", key="personnes_presentes")  # Ajout de ce champ
+    arrival_time = st.text_input("Heure d'arrivée (ex: 09h00)", key="arrival_time")
+    building_code = st.text_input("Code Immeuble", key="building_code")
+    if building_code and not st.session_state.get('observations'):
+        draft = get_draft_journal().find_draft(building_code, st.session_state.draft_id)
+        if draft:
+            draft_id, updated_at = draft
+            st.info("Un brouillon non envoyé existe pour cet immeuble "
+                    f"(modifié le {datetime.fromtimestamp(updated_at).strftime('%d/%m/%Y à %H:%M')}).")
+            if st.button("Restaurer le brouillon"):
+                st.session_state.restore_draft_id = draft_id
+                st.rerun()
+    quality_profile = st.selectbox(
+        "Qualité des photos du rapport",
+        list(QUALITY_PROFILES),
+        format_func=lambda p: "Email (léger)" if p == "email" else "Archive (haute définition)",
+    )
+    
+    main_image = photo_uploader("Photo principale de la copropriété", "main_image", max_files=1)
+    if main_image:
+        prefetch_uploads([main_image])
+if main_image:
+    show_image_preview(main_image, "Photo principale", "full_main_image")
+
+# Ajout du canvas de signature, même sans photo principale : la validation de "Générer" le lit toujours
+signature_canvas = signature_area()
+
+with col2:
+    st.subheader("🔍 Observations")
+    
+    if 'observations' not in st.session_state:
+        st.session_state.observations = []
+    
+    if 'form_key' not in st.session_state:
+        st.session_state.form_key = 0
+    
+    observation_form(quality_profile)
+    observation_list(quality_profile)
+
     st.markdown("---")
-    departure_time = st.text_input("Heure de départ (ex: 10h30)")
+    departure_time = st.text_input("Heure de départ (ex: 10h30)", key="departure_time")
+
+# Sauvegarde incrémentale du brouillon
+journal_fields({
+    "visit_date": date.isoformat(),
+    "address": address,
+    "redacteur": redacteur,
+    "personnes_presentes": personnes_presentes,
+    "arrival_time": arrival_time,
+    "building_code": building_code,
+    "departure_time": departure_time,
+})
+
+if 'email_deliveries' not in st.session_state:
+    st.session_state.email_deliveries = []
 
 # Bouton de génération du rapport
 st.markdown("---")
@@ -505,10 +471,11 @@ col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
     if st.button("Générer le rapport PDF", use_container_width=True):
         if address and building_code:
-            if signature_canvas.image_data is None:
+            # Le canevas renvoie toujours un tableau : on vérifie qu'il contient bien un tracé
+            if signature_canvas.image_data is None or is_signature_blank(signature_canvas.image_data):
                 st.error("Veuillez signer le document avant de générer le PDF")
             else:
-                with st.spinner("Génération et envoi du rapport en cours..."):
+                with st.spinner("Préparation du rapport..."):
                     data = {
                         "date": date,
                         "address": address,
@@ -521,31 +488,101 @@ with col2:
                     
                     # Conversion de la signature en image
                     try:
-                        # Convertir le numpy array en image PIL
-                        signature_array = signature_canvas.image_data.astype(np.uint8)
-                        signature_image = PILImage.fromarray(signature_array)
-                        
-                        # Sauvegarder l'image en bytes
-                        signature_buffer = BytesIO()
-                        signature_image.save(signature_buffer, format="PNG")
-                        signature_bytes = signature_buffer.getvalue()
-                        
-                        pdf = create_pdf(data, main_image, st.session_state.observations, signature_bytes)
-                        pdf_output = pdf.output(dest='S').encode('latin1')
-                        
-                        if send_pdf_by_email(pdf_output, date.strftime('%Y-%m-%d'), address):
-                            st.success("✅ PDF généré et envoyé par email avec succès!")
-                        
-                        st.download_button(
-                            label="Télécharger le rapport PDF",
-                            data=pdf_output,
-                            file_name=f"rapport_visite_{date.strftime('%Y%m%d')}.pdf",
-                            mime="application/pdf",
-                            use_container_width=True
-                        )
+                        with perf.trace("report.generate") as report_trace:
+                            with perf.span("signature.encode", images=1) as span:
+                                # Recadrée, encodée en 1 bit et mise en cache : les reruns ne la réencodent pas
+                                signature = normalize_signature(signature_canvas.image_data, quality_profile,
+                                                                on_error=st.error)
+                                span.add(bytes_in=signature_canvas.image_data.nbytes,
+                                         bytes_out=len(signature) if signature is not None else 0)
+                            
+                            observations = [resolve_photos(obs) for obs in st.session_state.observations]
+                            main_image_stored = stored_version(main_image) if main_image else None
+                            main_image_data = main_image_stored.data if main_image_stored else None
+                            # Sections pré-rendues à l'ajout des observations et photo principale, depuis les
+                            # caches de ce processus ; ce qui manque est préparé dans le pool, pas ici
+                            report_image, sections = prepare_report(main_image_data, observations, quality_profile)
+                            deliver = report_delivery(data, observations, main_image_data,
+                                                      st.session_state.draft_id, report_trace.trace_id)
+                            with perf.span("render.submit"):
+                                job_id = get_render_queue().submit(data, report_image, sections,
+                                                                   signature, quality_profile, on_done=deliver)
+                            st.session_state.render_job = {
+                                "id": job_id,
+                                "data": data,
+                                "draft_id": st.session_state.draft_id,
+                                "perf_trace": report_trace.trace_id,
+                            }
+                            st.session_state.pop('report_download', None)
+                        st.session_state.last_perf_trace = report_trace.trace_id
+                    except queue.Full:
+                        st.warning("Beaucoup de rapports sont en cours de génération : réessayez dans quelques instants.")
                     except Exception as e:
                         st.error(f"Erreur lors de la génération du PDF: {str(e)}")
         else:
             st.warning("Veuillez remplir au moins l'adresse et le code immeuble.")
     else:
         st.warning("Veuillez remplir au moins l'adresse et le code immeuble.")
+
+    # Suivi de la génération en cours : seul l'avancement s'actualise, le résultat est affiché
+    # au rerun complet qui suit la fin de la tâche
+    if 'render_job' in st.session_state:
+        render_job = st.session_state.render_job
+        render_queue = get_render_queue()
+        job = render_queue.status(render_job["id"])
+        state = job.get("state")
+        if state in ("pending", "running"):
+            render_progress(render_job["id"])
+        else:
+            del st.session_state.render_job
+            render_queue.forget(render_job["id"])
+            if state == "done":
+                show_report(render_job, job)
+            elif state == "cancelled":
+                st.info("Génération du rapport annulée.")
+            else:
+                st.error(f"Erreur lors de la génération du PDF: {job.get('error') or 'tâche introuvable'}")
+
+    if 'report_download' in st.session_state:
+        st.download_button(
+            label="Télécharger le rapport PDF",
+            data=st.session_state.report_download["data"],
+            file_name=st.session_state.report_download["file_name"],
+            mime="application/pdf",
+            use_container_width=True
+        )
+
+    # Suivi des envois d'emails de la session
+    if st.session_state.email_deliveries:
+        email_queue = get_email_queue()
+        for message_id in st.session_state.email_deliveries:
+            delivery = email_queue.status(message_id)
+            if not delivery:
+                continue
+            label = f"📧 {delivery['subject']} : {EMAIL_STATUS_LABELS[delivery['state']]}"
+            if delivery['state'] == "sent":
+                st.success(label)
+            elif delivery['state'] == "failed":
+                st.error(f"{label} ({delivery['error']})")
+            else:
+                st.info(f"{label} (tentative {delivery['attempts']})")
+        # Le clic suffit à relancer la page
+        st.button("Actualiser le statut des envois")
+
+# Diagnostic des performances
+with st.expander("🛠️ Diagnostic des performances"):
+    perf_enabled = st.toggle("Mesurer les étapes de génération", value=perf.is_enabled())
+    if perf_enabled != perf.is_enabled():
+        perf.enable(perf_enabled)
+    if st.session_state.get('last_perf_trace'):
+        spans = [s for s in perf.recent_spans() if s['trace'] == st.session_state.last_perf_trace]
+        if spans:
+            st.markdown("**Dernière génération**")
+            import pandas as pd  # seulement pour ce panneau de diagnostic
+            st.dataframe(pd.DataFrame(spans).drop(columns=["trace"]), use_container_width=True, hide_index=True)
+    st.markdown("**Cache des photos**")
+    st.json(get_image_normalizer().cache.stats())
+    # Photos des observations de la session : en mémoire jusqu'au budget, au-delà sur disque
+    st.markdown("**Photos de la session**")
+    st.json(st.session_state.photo_store.stats())
+    st.caption(f"Mesures exportées dans {perf.SPANS_PATH} et {perf.PROMETHEUS_PATH}")
@@ -0,0 +1,127 @@
+"""Génération de rapports de visite en ligne de commande, sans l'interface Streamlit.
+
+Chaque visite est un fichier JSON :
+
+    {
+        "date": "2024-03-18",
+        "address": "12 rue de la Paix, Paris",
+        "redacteur": "Elodie BONNAY",
+        "personnes_presentes": "M. Dupont (conseil syndical)",
+        "arrival_time": "09h00",
+        "departure_time": "10h30",
+        "building_code": "1234",
+        "main_image": "photos/facade.heic",
+        "signature": "signature.png",
+        "observations": [
+            {"type": "❌ A améliorer", "description": "...", "action": "...",
+             "photos": ["photos/toiture.jpg"]}
+        ]
+    }
+
+Les chemins d'images sont relatifs au dossier du fichier JSON, ou à --images-dir.
+Chaque PDF est nommé d'après le chemin du JSON relatif au dossier commun à toutes les
+visites (visites/a/visit.json et visites/b/visit.json -> rapport_visite_a_visit.pdf et
+rapport_visite_b_visit.pdf) ; deux visites qui donneraient le même nom sont refusées.
+
+Exemple :
+    python batch_render.py visites/*.json -o rapports/ --profile archive -j 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from report_engine import DEFAULT_QUALITY_PROFILE, QUALITY_PROFILES, create_pdf
+
+
+def load_visit(json_path, images_dir=None):
+    with open(json_path, encoding="utf-8") as f:
+        visit = json.load(f)
+    base_dir = images_dir or os.path.dirname(os.path.abspath(json_path))
+
+    def resolve(path):
+        return path if path is None or os.path.isabs(path) else os.path.join(base_dir, path)
+
+    data = {key: visit.get(key, "") for key in ("date", "address", "redacteur", "personnes_presentes",
+                                                 "arrival_time", "departure_time", "building_code")}
+    observations = [
+        {
+            "type": obs.get("type", ""),
+            "description": obs.get("description", ""),
+            "action": obs.get("action", ""),
+            "photos": [resolve(photo) for photo in obs.get("photos", [])],
+        }
+        for obs in visit.get("observations", [])
+    ]
+    return data, resolve(visit.get("main_image")), observations, resolve(visit.get("signature"))
+
+
+def output_names(json_paths):
+    # Chemin relatif au dossier commun, sans extension : une visite par dossier (*/visit.json)
+    # ne donne pas le même nom à tous les rapports
+    paths = [os.path.abspath(path) for path in json_paths]
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    names = {}
+    for json_path, path in zip(json_paths, paths):
+        name = os.path.splitext(os.path.relpath(path, root))[0].replace(os.sep, "_")
+        names.setdefault(f"rapport_visite_{name}.pdf", []).append(json_path)
+    collisions = {name: sources for name, sources in names.items() if len(sources) > 1}
+    if collisions:
+        raise ValueError("; ".join(f"{name} : {', '.join(sources)}" for name, sources in collisions.items()))
+    return {sources[0]: name for name, sources in names.items()}
+
+
+def render_visit(json_path, output_path, profile, images_dir=None):
+    start = time.perf_counter()
+    data, main_image, observations, signature = load_visit(json_path, images_dir)
+    errors = []
+    pdf = create_pdf(data, main_image, observations, signature, profile, on_error=errors.append)
+    pdf.output(output_path, 'F')
+    return output_path, time.perf_counter() - start, errors, pdf.duplicate_images
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Génère les rapports PDF de visites décrites en JSON.")
+    parser.add_argument("visits", nargs="+", help="fichiers JSON des visites")
+    parser.add_argument("-o", "--output-dir", default="rapports", help="dossier de sortie des PDF")
+    parser.add_argument("--images-dir", help="dossier des images (par défaut : celui de chaque JSON)")
+    parser.add_argument("--profile", choices=list(QUALITY_PROFILES), default=DEFAULT_QUALITY_PROFILE,
+                        help="profil de qualité des photos")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="nombre de processus (par défaut : nombre de cœurs)")
+    args = parser.parse_args(argv)
+    try:
+        names = output_names(args.visits)
+    except ValueError as e:
+        parser.error(f"plusieurs visites donneraient le même rapport ({e})")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    failures = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            pool.submit(render_visit, path, os.path.join(args.output_dir, names[path]), args.profile,
+                        args.images_dir): path
+            for path in args.visits
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                output_path, elapsed, errors, duplicates = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"ÉCHEC {path} : {e}", file=sys.stderr)
+                continue
+            for error in errors:
+                print(f"ATTENTION {path} : {error}", file=sys.stderr)
+            print(f"{output_path} ({elapsed:.2f} s, {duplicates} image(s) dédupliquée(s))")
+
+    print(f"{len(args.visits) - failures}/{len(args.visits)} rapports générés "
+          f"en {time.perf_counter() - start:.1f} s")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""Banc d'essai de la génération des rapports, de bout en bout et reproductible.
+
+Chaque cas construit une visite synthétique : N observations de 0 à 3 photos chacune,
+mélange de JPEG, PNG et HEIC aux résolutions des téléphones avec orientations EXIF
+variées, plus une signature dessinée sur le canevas. Le moteur de rapport est exécuté
+dans un processus neuf par cas pour mesurer la latence à froid (caches vides), la
+latence à chaud (même visite régénérée), le pic de RSS et la taille du PDF.
+
+Les résultats sont comparés à baseline.json ; un dépassement des seuils fait échouer
+la commande. Les valeurs de référence dépendent de la machine : les régénérer avec
+--update-baseline sur la machine de mesure après un changement volontaire.
+
+Exemples :
+    python benchmarks/bench_report.py
+    python benchmarks/bench_report.py --cases 1 10 --profile archive
+    python benchmarks/bench_report.py --update-baseline
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+FIXTURES_DIR = os.path.join(BENCH_DIR, ".fixtures")
+DEFAULT_CASES = [1, 10, 50]
+SEED = 20240318
+
+# Résolutions rencontrées sur les téléphones des gestionnaires (largeur, hauteur)
+PHONE_RESOLUTIONS = [(4032, 3024), (4000, 3000), (3264, 2448)]
+SCREENSHOT_RESOLUTION = (1170, 2532)
+ORIENTATIONS = [1, 1, 3, 6, 8]
+
+
+def _synthetic_photo(rng, width, height):
+    # Dégradé plus bruit basse fréquence : des tailles JPEG proches de vraies photos
+    import numpy as np
+    from PIL import Image
+
+    small = rng.integers(0, 256, size=(height // 16, width // 16, 3), dtype=np.uint8)
+    img = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+    gradient = np.linspace(0, 80, width, dtype=np.float32)[None, :, None]
+    pixels = np.clip(np.asarray(img, dtype=np.float32) * 0.7 + gradient, 0, 255).astype(np.uint8)
+    pixels += rng.integers(0, 12, size=pixels.shape, dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def _encode_photo(img, fmt, orientation):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    exif[274] = orientation
+    if fmt == "JPEG":
+        img.save(buffer, format="JPEG", quality=90, exif=exif.tobytes())
+    elif fmt == "HEIF":
+        img.save(buffer, format="HEIF", quality=80, exif=exif.tobytes())
+    else:
+        img.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def _synthetic_signature(rng):
+    # Tracé à main levée sur un canevas RGBA 300x150, comme st_canvas
+    import numpy as np
+
+    canvas = np.zeros((150, 300, 4), dtype=np.uint8)
+    x, y = 40.0, 90.0
+    for _ in range(400):
+        x = min(max(x + rng.normal(0.6, 1.0), 5), 294)
+        y = min(max(y + rng.normal(0, 2.0), 5), 144)
+        canvas[int(y) - 1:int(y) + 1, int(x) - 1:int(x) + 1] = (0, 0, 0, 255)
+    return canvas
+
+
+def build_fixtures(n_observations, seed=SEED):
+    # Visite décrite en JSON, photos sur disque ; réutilisée d'une exécution à l'autre
+    import numpy as np
+    from PIL import Image
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+
+    case_dir = os.path.join(FIXTURES_DIR, f"obs_{n_observations}_{seed}")
+    visit_path = os.path.join(case_dir, "visit.json")
+    if os.path.exists(visit_path):
+        return visit_path
+    os.makedirs(case_dir, exist_ok=True)
+    rnd = random.Random(seed + n_observations)
+    rng = np.random.default_rng(seed + n_observations)
+
+    def make_photo(name):
+        fmt = rnd.choice(["JPEG", "JPEG", "JPEG", "HEIF", "PNG"])
+        width, height = SCREENSHOT_RESOLUTION if fmt == "PNG" else rnd.choice(PHONE_RESOLUTIONS)
+        extension = {"JPEG": "jpg", "HEIF": "heic", "PNG": "png"}[fmt]
+        path = os.path.join(case_dir, f"{name}.{extension}")
+        with open(path, "wb") as f:
+            f.write(_encode_photo(_synthetic_photo(rng, width, height), fmt, rnd.choice(ORIENTATIONS)))
+        return os.path.basename(path)
+
+    observations = []
+    for idx in range(n_observations):
+        words = rnd.randint(10, 120)
+        observations.append({
+            "type": rnd.choice(["✅ Positive", "❌ A améliorer"]),
+            "description": " ".join(rnd.choice(["fissure", "façade", "éclairage", "propreté", "toiture",
+                                                "ascenseur", "local poubelles", "très", "état", "à"])
+                                    for _ in range(words)),
+            "action": "Relancer l'entreprise et demander un devis." if rnd.random() < 0.5 else "",
+            "photos": [make_photo(f"obs_{idx}_{k}") for k in range(rnd.randint(0, 3))],
+        })
+    Image.fromarray(_synthetic_signature(rng)).save(os.path.join(case_dir, "signature.png"))
+    visit = {
+        "date": "2024-03-18",
+        "address": "12 rue de la République, Lyon",
+        "redacteur": "Elodie BONNAY",
+        "personnes_presentes": "M. Dupont (conseil syndical), Mme Martin (gardienne)",
+        "arrival_time": "09h00",
+        "departure_time": "10h30",
+        "building_code": str(1000 + n_observations),
+        "main_image": make_photo("main"),
+        "signature": "signature.png",
+        "observations": observations,
+    }
+    with open(visit_path, "w", encoding="utf-8") as f:
+        json.dump(visit, f, ensure_ascii=False, indent=2)
+    return visit_path
+
+
+def _peak_rss_mb():
+    # VmHWM repart de zéro à l'exec, contrairement à ru_maxrss hérité du parent
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss est en kilo-octets sous Linux, en octets sous macOS
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor, 1)
+
+
+def run_case(visit_path, profile, warm_runs):
+    # Exécuté dans un processus neuf : caches vides et RSS propre au cas
+    from batch_render import load_visit
+    from report_engine import create_pdf
+
+    data, main_image, observations, signature = load_visit(visit_path)
+
+    def generate():
+        start = time.perf_counter()
+        pdf = create_pdf(data, main_image, observations, signature, profile)
+        output = pdf.output(dest='S')
+        return time.perf_counter() - start, len(output), pdf.page
+
+    cold_s, pdf_bytes, pages = generate()
+    warm_s = min(generate()[0] for _ in range(warm_runs)) if warm_runs else None
+    photos = sum(len(obs["photos"]) for obs in observations) + (1 if main_image else 0)
+    return {
+        "observations": len(observations),
+        "photos": photos,
+        "pages": pages,
+        "cold_s": round(cold_s, 4),
+        "warm_s": round(warm_s, 4) if warm_s is not None else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "pdf_kb": round(pdf_bytes / 1024, 1),
+    }
+
+
+def compare(results, baseline):
+    thresholds = baseline["thresholds"]
+    # Marge absolue : évite les fausses alertes sur les mesures de quelques millisecondes
+    slack = baseline.get("slack", {})
+    regressions = []
+    for case, result in results.items():
+        reference = baseline["cases"].get(case)
+        if reference is None:
+            continue
+        for metric, limit in thresholds.items():
+            if not reference.get(metric) or result.get(metric) is None:
+                continue
+            if result[metric] > max(reference[metric] * limit, reference[metric] + slack.get(metric, 0)):
+                regressions.append(f"{case} {metric} : {result[metric]} > {reference[metric]} x {limit}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai de la génération des rapports.")
+    parser.add_argument("--cases", type=int, nargs="+", default=DEFAULT_CASES, help="nombres d'observations")
+    parser.add_argument("--profile", default="email", help="profil de qualité des photos")
+    parser.add_argument("--warm-runs", type=int, default=2, help="régénérations à chaud par cas")
+    parser.add_argument("--update-baseline", action="store_true", help="enregistre les résultats comme référence")
+    parser.add_argument("--output", help="écrit aussi les résultats dans ce fichier JSON")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.profile, args.warm_runs)))
+        return 0
+
+    results = {}
+    for n in args.cases:
+        visit_path = build_fixtures(n)
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-case", visit_path,
+             "--profile", args.profile, "--warm-runs", str(args.warm_runs)],
+            capture_output=True, text=True, check=True,
+        )
+        results[f"obs_{n}_{args.profile}"] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    print(f"{'cas':<16}{'photos':>7}{'pages':>7}{'froid (s)':>11}{'chaud (s)':>11}{'RSS (Mo)':>10}{'PDF (Ko)':>10}")
+    for case, r in results.items():
+        print(f"{case:<16}{r['photos']:>7}{r['pages']:>7}{r['cold_s']:>11}{str(r['warm_s']):>11}"
+              f"{r['peak_rss_mb']:>10}{r['pdf_kb']:>10}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if args.update_baseline:
+        baseline["cases"].update(results)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"Référence mise à jour : {BASELINE_PATH}")
+        return 0
+
+    regressions = compare(results, baseline)
+    for regression in regressions:
+        print(f"RÉGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
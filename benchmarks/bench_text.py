@@ -0,0 +1,116 @@
+"""Microbanc d'essai de la normalisation du texte des rapports.
+
+Compare, par appel, l'ancienne boucle de clean_text_for_pdf (dictionnaire reconstruit,
+un str.replace par entrée puis un filtrage caractère par caractère) à la table de
+traduction précompilée de pdf_text, sans mémorisation (première rencontre d'une chaîne)
+et avec (chaîne déjà vue : adresse, type d'observation, section régénérée). Mesure aussi
+la découpe en lignes d'une description, qui mesure chaque mot avec la police du rapport.
+
+Exemples :
+    python benchmarks/bench_text.py
+    python benchmarks/bench_text.py --number 20000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from pdf_text import clean_text_for_pdf, pdf_safe_text  # noqa: E402
+from report_engine import _wrap_lines  # noqa: E402
+
+SAMPLES = {
+    "type": "❌ A améliorer",
+    "adresse": "12 rue de l’Église, 69002 Lyon",
+    "description": ("Fissure d’environ 2 m² sur la façade côté cour — l’entreprise doit intervenir "
+                    "avant l’hiver ; coût estimé à 1 500 €. Éclairage du hall à vérifier… ") * 12,
+    "ascii": "Relancer l'entreprise et demander un devis pour la toiture. " * 4,
+}
+
+
+def legacy_clean_text_for_pdf(text):
+    # Version précédente, recopiée telle quelle pour comparaison
+    text = str(text)
+    # Caractères spéciaux et leurs remplacements
+    replacements = {
+        "✅": "+",
+        "❌": "-",
+        "'": "'",
+        "'": "'",
+        """: '"',
+        """: '"',
+        "é": "e",
+        "è": "e",
+        "à": "a",
+        "ê": "e",
+        "û": "u",
+        "ô": "o",
+        "î": "i",
+        "ï": "i",
+        "ë": "e",
+        "ü": "u",
+        "ç": "c",
+        "œ": "oe",
+        "æ": "ae",
+        "â": "a",
+        "É": "E",
+        "È": "E",
+        "À": "A",
+        "Ê": "E",
+        "Û": "U",
+        "Ô": "O",
+        "Î": "I",
+        "Ï": "I",
+        "Ë": "E",
+        "Ü": "U",
+        "Ç": "C",
+        "Â": "A",
+        "…": "...",
+        "—": "-",
+        "–": "-",
+        "'": "'",
+        "°": " degres ",
+        "²": "2",
+        "€": "EUR",
+        "\u2019": "'",  # apostrophe courbe
+        "\u2018": "'",  # autre apostrophe
+        "\u2013": "-",  # tiret demi-cadratin
+        "\u2014": "-",  # tiret cadratin
+        "\u2026": "...", # points de suspension
+    }
+    
+    for old, new in replacements.items():
+        text = text.replace(old, new)
+    
+    # Supprimer tous les autres caractères non-ASCII qui pourraient causer des problèmes
+    text = ''.join(char if ord(char) < 128 else ' ' for char in text)
+    return text
+
+
+def _per_call_us(func, text, number):
+    return min(timeit.repeat(lambda: func(text), number=number, repeat=5)) / number * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbanc d'essai de la normalisation du texte des rapports.")
+    parser.add_argument("--number", type=int, default=5000, help="appels par mesure")
+    args = parser.parse_args(argv)
+
+    clean_text_for_pdf("é")  # lecture des métriques de la police, hors mesure
+    print(f"{'texte':<14}{'caractères':>11}{'ancienne (µs)':>15}{'table (µs)':>12}{'mémorisée (µs)':>16}{'gain':>8}")
+    for name, text in SAMPLES.items():
+        legacy = _per_call_us(legacy_clean_text_for_pdf, text, args.number)
+        table = _per_call_us(pdf_safe_text, text, args.number)
+        memoized = _per_call_us(clean_text_for_pdf, text, args.number)
+        print(f"{name:<14}{len(text):>11}{legacy:>15.2f}{table:>12.2f}{memoized:>16.2f}{legacy / table:>7.1f}x")
+
+    description = clean_text_for_pdf(SAMPLES["description"])
+    wrap_us = _per_call_us(lambda text: _wrap_lines(text, '', 10), description, max(1, args.number // 50))
+    print(f"Découpe en lignes de la description : {wrap_us:.0f} µs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
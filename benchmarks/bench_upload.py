@@ -0,0 +1,127 @@
+"""Banc d'essai de la préparation des photos dans le navigateur, sans interface.
+
+La page du composant ``components/photo_upload`` est ouverte seule dans Chromium sans
+interface (Playwright), puis chaque photo des fixtures de bench_report.py y est
+téléversée. Pour chaque photo : taille d'origine, taille envoyée, temps de préparation
+dans le navigateur et temps de normalisation évité sur le serveur. La commande échoue
+si une photo préparée n'est pas un JPEG, dépasse la largeur demandée ou n'a pas les
+dimensions (orientation EXIF comprise) de la normalisation côté serveur.
+
+Playwright n'est utile qu'ici, il ne fait pas partie de requirements.txt :
+    pip install playwright && playwright install chromium
+
+Exemples :
+    python benchmarks/bench_upload.py
+    python benchmarks/bench_upload.py --case 50 --max-width-px 1122 --quality 75
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import pathlib
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_report import build_fixtures  # noqa: E402
+from photo_upload import PHOTO_UPLOAD_DIR, PHOTO_UPLOAD_MAX_WIDTH_PX, PHOTO_UPLOAD_QUALITY  # noqa: E402
+
+
+def _photo_paths(visit_path):
+    with open(visit_path, encoding="utf-8") as f:
+        visit = json.load(f)
+    names = [visit["main_image"]] + [photo for obs in visit["observations"] for photo in obs["photos"]]
+    return [os.path.join(os.path.dirname(visit_path), name) for name in names]
+
+
+def _check(photo, path, max_width_px, quality):
+    # Dimensions attendues : celles de la normalisation côté serveur
+    from PIL import Image
+    from report_engine import _normalize_image
+
+    with open(path, "rb") as f:
+        original = f.read()
+    start = time.perf_counter()
+    expected = _normalize_image(original, max_width_px, quality)
+    server_ms = (time.perf_counter() - start) * 1000
+    if not photo["prepared"]:
+        return server_ms, []
+    img = Image.open(io.BytesIO(photo["data"]))
+    problems = []
+    if img.format != "JPEG":
+        problems.append(f"format {img.format}")
+    if img.width > max_width_px:
+        problems.append(f"largeur {img.width} > {max_width_px}")
+    if abs(img.width - expected.width) > 1 or abs(img.height - expected.height) > 1:
+        problems.append(f"{img.width}x{img.height} au lieu de {expected.width}x{expected.height}")
+    return server_ms, problems
+
+
+def run(paths, max_width_px, quality):
+    from playwright.sync_api import sync_playwright
+
+    url = pathlib.Path(PHOTO_UPLOAD_DIR, "index.html").as_uri() + f"?max_width_px={max_width_px}&quality={quality}"
+    results = []
+    with sync_playwright() as playwright:
+        browser = playwright.chromium.launch()
+        page = browser.new_page()
+        page.goto(url)
+        page.wait_for_selector("body[data-state=ready]")
+        for path in paths:
+            page.evaluate("document.body.dataset.state = 'ready'")
+            page.set_input_files("#input", path)
+            page.wait_for_function("['done', 'error'].includes(document.body.dataset.state)", timeout=60000)
+            if page.evaluate("document.body.dataset.state") == "error":
+                results.append({"path": path, "error": page.inner_text("#files")})
+                continue
+            photo = page.evaluate("window.preparedPhotos[0]")
+            photo["data"] = base64.b64decode(photo["data"])
+            results.append({"path": path, "photo": photo})
+        browser.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai de la préparation des photos dans le navigateur.")
+    parser.add_argument("--case", type=int, default=10, help="nombre d'observations de la visite de test")
+    parser.add_argument("--max-width-px", type=int, default=PHOTO_UPLOAD_MAX_WIDTH_PX, help="largeur maximale")
+    parser.add_argument("--quality", type=int, default=PHOTO_UPLOAD_QUALITY, help="qualité JPEG")
+    args = parser.parse_args(argv)
+
+    try:
+        import playwright  # noqa: F401
+    except ImportError:
+        print("Playwright est nécessaire : pip install playwright && playwright install chromium", file=sys.stderr)
+        return 2
+
+    paths = _photo_paths(build_fixtures(args.case))
+    failures = 0
+    total_original = total_sent = 0
+    print(f"{'photo':<16}{'origine (Ko)':>14}{'envoyé (Ko)':>13}{'navigateur (ms)':>17}{'serveur évité (ms)':>20}")
+    for result in run(paths, args.max_width_px, args.quality):
+        name = os.path.basename(result["path"])
+        if "error" in result:
+            failures += 1
+            print(f"ÉCHEC {name} : {result['error']}", file=sys.stderr)
+            continue
+        photo = result["photo"]
+        server_ms, problems = _check(photo, result["path"], args.max_width_px, args.quality)
+        total_original += photo["original_size"]
+        total_sent += photo["size"]
+        saved = f"{server_ms:.0f}" if photo["prepared"] else "converti"
+        print(f"{name:<16}{photo['original_size'] / 1024:>14.0f}{photo['size'] / 1024:>13.0f}"
+              f"{photo['elapsed_ms']:>17.0f}{saved:>20}")
+        for problem in problems:
+            failures += 1
+            print(f"ÉCHEC {name} : {problem}", file=sys.stderr)
+    if total_original:
+        print(f"Total : {total_original / 1024 / 1024:.1f} Mo -> {total_sent / 1024 / 1024:.1f} Mo envoyés "
+              f"({100 * total_sent / total_original:.0f} %)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Journal des visites en cours, pour retrouver un brouillon après une coupure de session.
+
+Chaque action (champ modifié, observation ajoutée, modifiée ou supprimée) est ajoutée
+comme un petit événement dans une base SQLite en mode WAL ; les photos sont enregistrées
+une seule fois par empreinte. Un brouillon se reconstruit en rejouant ses événements.
+Les brouillons jamais envoyés sont purgés, photos comprises, après DRAFT_RETENTION_SECONDS.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DRAFT_JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "brouillons.sqlite")
+
+# Durée de conservation d'un brouillon sans activité (visite abandonnée)
+DRAFT_RETENTION_SECONDS = 14 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS drafts (
+    draft_id TEXT PRIMARY KEY,
+    building_code TEXT,
+    updated_at REAL NOT NULL,
+    finalized INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS drafts_building_code ON drafts (building_code, finalized, updated_at);
+CREATE INDEX IF NOT EXISTS drafts_updated_at ON drafts (updated_at);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    draft_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_draft ON events (draft_id, id);
+CREATE TABLE IF NOT EXISTS photos (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS draft_photos (
+    draft_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (draft_id, key)
+);
+CREATE INDEX IF NOT EXISTS draft_photos_key ON draft_photos (key);
+"""
+
+
+class DraftJournal:
+    def __init__(self, path=DRAFT_JOURNAL_PATH, retention=DRAFT_RETENTION_SECONDS):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.retention = retention
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self.purge()
+
+    def _append(self, draft_id, kind, payload, building_code=None):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO events (draft_id, created_at, kind, payload) VALUES (?, ?, ?, ?)",
+                (draft_id, now, kind, json.dumps(payload, ensure_ascii=False)),
+            )
+            self._db.execute(
+                "INSERT INTO drafts (draft_id, building_code, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (draft_id) DO UPDATE SET updated_at = excluded.updated_at, "
+                "building_code = COALESCE(excluded.building_code, drafts.building_code)",
+                (draft_id, building_code, now),
+            )
+
+    def record_field(self, draft_id, name, value):
+        building_code = value if name == "building_code" and value else None
+        self._append(draft_id, "field", {"name": name, "value": value}, building_code)
+
+    def record_observation(self, draft_id, obs, photos):
+        # photos : {empreinte: octets} ; INSERT OR IGNORE n'écrit que les photos jamais vues
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO photos (key, data) VALUES (?, ?)", photos.items())
+            self._db.executemany("INSERT OR IGNORE INTO draft_photos (draft_id, key) VALUES (?, ?)",
+                                 [(draft_id, key) for key in photos])
+        self._append(draft_id, "observation", obs)
+
+    def delete_observation(self, draft_id, obs_id):
+        self._append(draft_id, "delete", {"id": obs_id})
+
+    def _drop(self, draft_ids):
+        # Appelé avec self._lock acquis, dans une transaction : événements et photos des brouillons
+        self._db.executemany("DELETE FROM events WHERE draft_id = ?", [(draft_id,) for draft_id in draft_ids])
+        self._db.executemany("DELETE FROM draft_photos WHERE draft_id = ?", [(draft_id,) for draft_id in draft_ids])
+        self._db.execute("DELETE FROM photos WHERE key NOT IN (SELECT key FROM draft_photos)")
+
+    def finalize(self, draft_id):
+        # Le rapport est parti : le brouillon et ses photos ne sont plus nécessaires
+        with self._lock, self._db:
+            self._db.execute("UPDATE drafts SET finalized = 1 WHERE draft_id = ?", (draft_id,))
+            self._drop([draft_id])
+        # Un rapport par visite : occasion régulière d'oublier les visites abandonnées
+        self.purge()
+
+    def discard(self, draft_id):
+        # Brouillon remplacé (session qui en restaure un autre) : il ne doit plus être proposé
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM drafts WHERE draft_id = ?", (draft_id,))
+            self._drop([draft_id])
+
+    def purge(self):
+        # Brouillons sans activité depuis la durée de conservation, envoyés ou non
+        limit = time.time() - self.retention
+        with self._lock, self._db:
+            draft_ids = [row[0] for row in self._db.execute(
+                "SELECT draft_id FROM drafts WHERE updated_at < ?", (limit,))]
+            if draft_ids:
+                self._db.executemany("DELETE FROM drafts WHERE draft_id = ?", [(draft_id,) for draft_id in draft_ids])
+                self._drop(draft_ids)
+        return len(draft_ids)
+
+    def find_draft(self, building_code, exclude_draft_id=None):
+        # Brouillon non envoyé le plus récent pour cet immeuble, hors celui de la session courante
+        with self._lock:
+            row = self._db.execute(
+                "SELECT draft_id, updated_at FROM drafts WHERE building_code = ? AND finalized = 0 "
+                "AND draft_id != ? ORDER BY updated_at DESC LIMIT 1",
+                (building_code, exclude_draft_id or ""),
+            ).fetchone()
+        return row
+
+    def load_draft(self, draft_id):
+        # Rejoue les événements : le dernier état de chaque champ et de chaque observation l'emporte
+        fields = {}
+        observations = {}
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT kind, payload FROM events WHERE draft_id = ? ORDER BY id", (draft_id,)
+            ).fetchall()
+        for kind, payload in rows:
+            payload = json.loads(payload)
+            if kind == "field":
+                fields[payload["name"]] = payload["value"]
+            elif kind == "observation":
+                observations[payload["id"]] = payload
+            elif kind == "delete":
+                observations.pop(payload["id"], None)
+        return fields, list(observations.values())
+
+    def get_photo(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM photos WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
@@ -0,0 +1,166 @@
+"""Envoi des rapports par email en arrière-plan.
+
+Un seul thread garde une connexion SMTP authentifiée ouverte, la réutilise d'un message à
+l'autre et réessaie avec un délai croissant. Les messages sont construits au moment de
+l'envoi, pour ne pas garder de copie base64 des PDF en attente.
+"""
+import contextvars
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import perf
+from report_engine import clean_text_for_pdf
+
+
+# États d'un envoi dans la file d'emails
+EMAIL_STATUS_LABELS = {
+    "pending": "en attente",
+    "sending": "en cours d'envoi",
+    "retrying": "nouvel essai prévu",
+    "sent": "envoyé",
+    "failed": "échec",
+}
+
+
+class EmailDeliveryQueue:
+    # File d'envoi en arrière-plan : un seul thread garde une connexion SMTP
+    # authentifiée ouverte, la réutilise d'un message à l'autre et réessaie en cas d'échec
+    def __init__(self, smtp_config, max_attempts=4, backoff_seconds=2.0, idle_timeout=120):
+        self.smtp_config = smtp_config
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.idle_timeout = idle_timeout
+        self._queue = queue.Queue()
+        self._statuses = {}
+        self._lock = threading.Lock()
+        self._connection = None
+        self._worker = threading.Thread(target=self._run, name="email-delivery", daemon=True)
+        self._worker.start()
+
+    def submit(self, build_message, subject):
+        # build_message() construit le message au moment de l'envoi : la pièce jointe encodée
+        # en base64 n'existe que le temps de l'envoi, dans le thread d'envoi
+        message_id = uuid.uuid4().hex
+        self._set_status(message_id, state="pending", attempts=0, error=None, subject=subject)
+        # Le contexte accompagne le message pour rattacher la mesure de l'envoi à sa génération
+        self._queue.put((message_id, build_message, contextvars.copy_context()))
+        return message_id
+
+    def status(self, message_id):
+        with self._lock:
+            return dict(self._statuses.get(message_id, {}))
+
+    def _set_status(self, message_id, **fields):
+        with self._lock:
+            self._statuses.setdefault(message_id, {}).update(fields, updated_at=time.time())
+
+    def _connect(self):
+        config = self.smtp_config
+        if config.get("use_ssl", True):
+            server = smtplib.SMTP_SSL(config["smtp_server"], config["smtp_port"], timeout=30)
+        else:
+            server = smtplib.SMTP(config["smtp_server"], config["smtp_port"], timeout=30)
+            if config.get("starttls", False):
+                server.starttls()
+        if config.get("username"):
+            server.login(config["username"], config["password"])
+        return server
+
+    def _get_connection(self):
+        # Réutilise la connexion si le serveur répond encore, sinon se reconnecte
+        if self._connection is not None:
+            try:
+                if self._connection.noop()[0] == 250:
+                    return self._connection
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close()
+        self._connection = self._connect()
+        return self._connection
+
+    def _close(self):
+        if self._connection is not None:
+            try:
+                self._connection.quit()
+            except Exception:
+                pass
+            self._connection = None
+
+    def _deliver(self, message_id, build_message):
+        msg = None
+        for attempt in range(1, self.max_attempts + 1):
+            self._set_status(message_id, state="sending", attempts=attempt)
+            try:
+                with perf.span("email.smtp", attempts=1):
+                    if msg is None:
+                        msg = build_message()
+                    self._get_connection().send_message(msg)
+                self._set_status(message_id, state="sent", error=None)
+                return
+            except Exception as e:
+                # Connexion potentiellement dans un état incohérent : on repart de zéro
+                self._close()
+                if attempt == self.max_attempts:
+                    self._set_status(message_id, state="failed", error=str(e))
+                    return
+                self._set_status(message_id, state="retrying", error=str(e))
+                time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+
+    def _run(self):
+        while True:
+            try:
+                message_id, build_message, context = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # Pas d'envoi depuis un moment : libère la connexion
+                self._close()
+                continue
+            try:
+                context.run(self._deliver, message_id, build_message)
+            finally:
+                self._queue.task_done()
+
+
+def recipient_for(redacteur):
+    if redacteur == "David SAINT-GERMAIN":
+        return "dsaintgermain@orpi.com"
+    elif redacteur == "Elodie BONNAY":
+        return "ebonnay@orpi.com"
+    else:  # Samuel KITA test
+        return "skita@orpi.com"
+
+
+def report_email_subject(date, address):
+    return f"Rapport de visite - {clean_text_for_pdf(address)} - {date}"
+
+
+def build_report_email(pdf_content, date, address, redacteur, sender):
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = recipient_for(redacteur)
+
+    address_clean = clean_text_for_pdf(address)
+    msg['Subject'] = report_email_subject(date, address)
+
+    body = f"""
+        Bonjour,
+
+        Veuillez trouver ci-joint le rapport de la visite effectuee le {date} a l'adresse : {address_clean}.
+
+        Cordialement,
+        Service Syndic ORPI
+        """
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+
+    pdf_attachment = MIMEApplication(pdf_content, _subtype='pdf')
+    pdf_attachment.add_header('Content-Disposition', 'attachment',
+                            filename=f'rapport_visite_{date}.pdf')
+    msg.attach(pdf_attachment)
+    return msg
@@ -0,0 +1,74 @@
+import time
+from datetime import datetime, timedelta
+
+import streamlit as st
+
+from visit_history import VisitHistory
+
+st.set_page_config(page_title="Historique des visites ORPI", layout="wide")
+
+@st.cache_resource(show_spinner=False)
+def get_visit_history():
+    return VisitHistory()
+
+history = get_visit_history()
+
+st.title("🔎 Historique des visites")
+
+text = st.text_input("Rechercher dans les observations", placeholder="ex. toiture fissure")
+col1, col2, col3, col4 = st.columns(4)
+with col1:
+    building_code = st.text_input("Code immeuble")
+with col2:
+    address = st.text_input("Adresse", placeholder="ex. rue eglise")
+with col3:
+    redacteur = st.selectbox("Rédacteur", ["Tous"] + history.redacteurs())
+with col4:
+    today = datetime.now().date()
+    period = st.date_input("Période", value=(today - timedelta(days=365), today))
+
+date_from, date_to = (period[0], period[-1]) if period else (None, None)
+start = time.perf_counter()
+results = history.search(
+    text=text,
+    building_code=building_code.strip() or None,
+    address=address.strip() or None,
+    redacteur=None if redacteur == "Tous" else redacteur,
+    date_from=date_from,
+    date_to=date_to,
+    limit=200,
+)
+elapsed_ms = (time.perf_counter() - start) * 1000
+
+# Regroupe les observations trouvées par visite, dans l'ordre des résultats
+visits = {}
+for row in results:
+    visit = visits.setdefault(row["id"], {**row, "hits": []})
+    if row.get("snippet"):
+        visit["hits"].append(row)
+
+st.caption(f"{len(visits)} visite(s) trouvée(s) en {elapsed_ms:.1f} ms")
+
+for visit_id, visit in visits.items():
+    title = f"{visit['visit_date']} — {visit['address']} (code {visit['building_code']}) — {visit['redacteur']}"
+    with st.expander(title):
+        for hit in visit["hits"]:
+            st.markdown(f"**Observation {hit['position'] + 1}** ({hit['type']}) : {hit['snippet']}")
+        # Vignettes et PDF ne sont lus dans la base qu'à la demande
+        if st.toggle("Photos", key=f"photos_{visit_id}"):
+            thumbnails = history.get_thumbnails(visit_id)
+            if thumbnails:
+                st.image([data for _, data in thumbnails], width=160)
+            else:
+                st.caption("Aucune photo.")
+        if st.session_state.get("history_pdf") == visit_id:
+            st.download_button(
+                label="Télécharger le rapport PDF",
+                data=history.get_pdf(visit_id),
+                file_name=f"rapport_visite_{visit['visit_date'].replace('-', '')}.pdf",
+                mime="application/pdf",
+                key=f"download_{visit_id}",
+            )
+        elif st.button("Préparer le PDF", key=f"pdf_{visit_id}"):
+            st.session_state.history_pdf = visit_id
+            st.rerun()
@@ -0,0 +1,95 @@
+import time
+from datetime import datetime, timedelta
+
+import streamlit as st
+
+from visit_analytics import (
+    VisitAnalytics,
+    negative_share_by_building,
+    recurring_actions,
+    visit_durations,
+    visits_per_redacteur,
+)
+
+st.set_page_config(page_title="Tableau de bord des visites ORPI", layout="wide")
+
+@st.cache_resource(show_spinner=False)
+def get_visit_analytics():
+    return VisitAnalytics()
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def dashboard(version, date_from, date_to, freq):
+    # version : clé d'invalidation, change à chaque visite enregistrée
+    analytics = get_visit_analytics()
+    visits = analytics.load("visits", ["visit_date", "building_code", "redacteur", "duration_min",
+                                       "observations", "negatives"], date_from, date_to)
+    observations = analytics.load("observations", ["visit_id", "visit_date", "building_code", "negative", "action"],
+                                  date_from, date_to)
+    return {
+        "visits": len(visits),
+        "observations": int(visits["observations"].sum()),
+        "negatives": int(visits["negatives"].sum()),
+        "median_duration": visits["duration_min"].median(),
+        "negative_share": negative_share_by_building(observations, freq),
+        "actions": recurring_actions(observations),
+        "durations": visit_durations(visits, freq),
+        "redacteurs": visits_per_redacteur(visits, freq),
+    }
+
+analytics = get_visit_analytics()
+
+st.title("📊 Tableau de bord des visites")
+
+col1, col2 = st.columns(2)
+with col1:
+    today = datetime.now().date()
+    period = st.date_input("Période", value=(today - timedelta(days=365), today))
+with col2:
+    grouping = st.radio("Regroupement", ["Mois", "Trimestre", "Année"], horizontal=True)
+    freq = {"Mois": "M", "Trimestre": "Q", "Année": "Y"}[grouping]
+
+date_from, date_to = (period[0], period[-1]) if period else (None, None)
+start = time.perf_counter()
+stats = dashboard(analytics.version(), date_from, date_to, freq)
+elapsed_ms = (time.perf_counter() - start) * 1000
+
+if not stats["visits"]:
+    st.info("Aucune visite enregistrée sur cette période.")
+    st.stop()
+
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Visites", stats["visits"])
+col2.metric("Observations", stats["observations"])
+col3.metric("À améliorer", f"{100 * stats['negatives'] / max(stats['observations'], 1):.0f} %")
+median_duration = stats["median_duration"]
+col4.metric("Durée médiane", "—" if median_duration != median_duration else f"{median_duration:.0f} min")
+st.caption(f"Calculé en {elapsed_ms:.1f} ms")
+
+st.subheader("Part des observations « à améliorer » par immeuble")
+share = stats["negative_share"]
+buildings = share.groupby("building_code")["observations"].sum().sort_values(ascending=False)
+selected = st.multiselect("Immeubles", list(buildings.index), default=list(buildings.index[:5]))
+if selected:
+    chart = share[share["building_code"].isin(selected)].pivot(index="period", columns="building_code", values="share")
+    st.line_chart(chart * 100)
+st.dataframe(
+    share.pivot(index="building_code", columns="period", values="share")
+         .rename(columns=lambda p: p.strftime("%Y-%m")).mul(100).round(0),
+    use_container_width=True,
+)
+
+col1, col2 = st.columns(2)
+with col1:
+    st.subheader("Actions récurrentes")
+    st.dataframe(
+        stats["actions"].rename(columns={"action": "Action", "occurrences": "Occurrences",
+                                         "buildings": "Immeubles", "last_seen": "Dernière fois"}),
+        hide_index=True,
+        use_container_width=True,
+    )
+with col2:
+    st.subheader("Visites par rédacteur")
+    st.bar_chart(stats["redacteurs"])
+
+st.subheader("Durée des visites (minutes)")
+st.line_chart(stats["durations"][["median", "mean"]].rename(columns={"median": "Médiane", "mean": "Moyenne"}))
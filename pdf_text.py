@@ -0,0 +1,190 @@
+"""Texte des rapports PDF : police Unicode intégrée et normalisation des chaînes.
+
+Les rapports sont composés en DejaVu Sans (dossier fonts/, licence LICENSE_DEJAVU.txt),
+intégrée en sous-ensemble : seuls les glyphes utilisés sont écrits dans le PDF et les
+accents sont conservés. Les métriques de chaque style sont lues une fois par processus.
+
+``clean_text_for_pdf`` ne remplace que les caractères sans glyphe dans la police, avec
+une table de traduction construite une fois et complétée au premier passage de chaque
+caractère inconnu ; les chaînes déjà normalisées sont mémorisées.
+"""
+import functools
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import fpdf.fpdf
+from fpdf.ttfonts import TTFontFile
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+PDF_FONT_FAMILY = "DejaVu"
+PDF_FONT_FILES = {
+    "": "DejaVuSans.ttf",
+    "B": "DejaVuSans-Bold.ttf",
+    "I": "DejaVuSans-Oblique.ttf",
+}
+
+# Chaînes normalisées mémorisées (adresses, types, descriptions...)
+CLEAN_TEXT_CACHE_SIZE = 4096
+
+# Sous-ensembles de police mémorisés (un document régénéré ou un pied de page réutilisent le leur)
+FONT_SUBSET_CACHE_SIZE = 32
+
+# Largeur notée par fpdf pour les glyphes sans chasse (accents combinants)
+_ZERO_WIDTH = 65535
+
+# Caractères sans glyphe dans la police, remplacés par un équivalent lisible
+_REPLACEMENTS = {
+    "✅": "+",
+    "❌": "-",
+    "✔": "+",
+    "✖": "-",
+    "\ufe0f": "",  # sélecteur de variante des emojis
+    "\u200b": "",  # espace sans chasse
+    "\ufeff": "",  # indicateur d'ordre des octets
+}
+
+
+@functools.lru_cache(maxsize=None)
+def font_metrics(style=""):
+    # Lecture du fichier TTF (une dizaine de ms par style), une fois par processus
+    path = os.path.join(FONT_DIR, PDF_FONT_FILES[style])
+    ttf = TTFontFile()
+    ttf.getMetrics(path)
+    return {
+        "name": ttf.fullName.replace(" ", "").replace("(", "").replace(")", ""),
+        "desc": {
+            "Ascent": int(round(ttf.ascent)),
+            "Descent": int(round(ttf.descent)),
+            "CapHeight": int(round(ttf.capHeight)),
+            "Flags": ttf.flags,
+            "FontBBox": "[%s %s %s %s]" % tuple(int(round(v)) for v in ttf.bbox),
+            "ItalicAngle": int(ttf.italicAngle),
+            "StemV": int(round(ttf.stemV)),
+            "MissingWidth": int(round(ttf.defaultWidth)),
+        },
+        "up": round(ttf.underlinePosition),
+        "ut": round(ttf.underlineThickness),
+        "cw": ttf.charWidths,
+        "ttffile": path,
+        "originalsize": os.stat(path).st_size,
+    }
+
+
+class _Subset(list):
+    # Liste des caractères utilisés, telle qu'attendue par fpdf : fpdf y ajoute chaque caractère
+    # dessiné et y cherche chacun des 65536 codes à l'écriture des largeurs ; sans doublons et
+    # avec un test d'appartenance en temps constant, l'écriture ne dépend plus de la longueur du texte
+    def __init__(self, codepoints):
+        super().__init__(dict.fromkeys(codepoints))
+        self._members = set(self)
+
+    def append(self, codepoint):
+        if codepoint not in self._members:
+            self._members.add(codepoint)
+            super().append(codepoint)
+
+    def __contains__(self, codepoint):
+        return codepoint in self._members
+
+    def __delitem__(self, index):
+        removed = self[index]
+        super().__delitem__(index)
+        self._members.difference_update(removed if isinstance(index, slice) else (removed,))
+
+
+class _CachedTTFontFile(TTFontFile):
+    # makeSubset relit et réécrit toute la police en Python (10 à 25 ms par style) :
+    # résultat mémorisé par fichier et par ensemble de caractères
+    _cache = OrderedDict()
+    _lock = threading.Lock()
+
+    def makeSubset(self, file, subset):
+        key = (file, frozenset(subset))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is None:
+            stream = super().makeSubset(file, subset)
+            cached = (stream, dict(self.codeToGlyph), self.maxUni)
+            with self._lock:
+                self._cache[key] = cached
+                while len(self._cache) > FONT_SUBSET_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        stream, code_to_glyph, self.maxUni = cached
+        self.codeToGlyph = dict(code_to_glyph)
+        return stream
+
+
+# fpdf instancie TTFontFile par son nom de module à l'écriture des polices
+fpdf.fpdf.TTFontFile = _CachedTTFontFile
+
+
+def install_font(pdf, style=""):
+    # Équivalent de FPDF.add_font(..., uni=True) sans relire le fichier TTF à chaque document ;
+    # appelé au premier usage d'un style, un style inutilisé n'est pas intégré
+    fontkey = PDF_FONT_FAMILY.lower() + style
+    if fontkey in pdf.fonts:
+        return
+    metrics = font_metrics(style)
+    pdf.fonts[fontkey] = {
+        "i": len(pdf.fonts) + 1, "type": "TTF", "name": metrics["name"], "desc": metrics["desc"],
+        "up": metrics["up"], "ut": metrics["ut"], "cw": metrics["cw"], "ttffile": metrics["ttffile"],
+        "fontkey": fontkey,
+        # Chiffres inclus d'office : le nombre total de pages n'est connu qu'à la fin
+        "subset": _Subset(range(0, 57)), "unifilename": None,
+    }
+    pdf.font_files[fontkey] = {"length1": metrics["originalsize"], "type": "TTF", "ttffile": metrics["ttffile"]}
+
+
+class _TranslationTable(dict):
+    # Table de str.translate : chaque caractère non ASCII est examiné une seule fois,
+    # les passages suivants sont de simples recherches dans le dictionnaire
+    def __init__(self, replacements, covered, zero_width):
+        super().__init__((ord(char), replacement) for char, replacement in replacements.items())
+        self.covered = covered
+        self.zero_width = zero_width
+
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        if codepoint in self.covered:
+            replacement = char
+        elif codepoint in self.zero_width:
+            # Accent combinant resté seul après NFC : fpdf lui donnerait une largeur aberrante
+            replacement = ""
+        else:
+            # Lettre décomposable dont la base existe dans la police, sinon une espace
+            base = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+            replacement = base if base and all(ord(c) in self.covered for c in base) else " "
+        self[codepoint] = replacement
+        return replacement
+
+
+@functools.lru_cache(maxsize=None)
+def _translation_table():
+    # Caractères dessinables dans tous les styles
+    covered = zero_width = None
+    for style in PDF_FONT_FILES:
+        widths = font_metrics(style)["cw"]
+        drawable = {cp for cp, w in enumerate(widths) if w and w != _ZERO_WIDTH}
+        marks = {cp for cp, w in enumerate(widths) if w == _ZERO_WIDTH}
+        covered = drawable if covered is None else covered & drawable
+        zero_width = marks if zero_width is None else zero_width & marks
+    return _TranslationTable(_REPLACEMENTS, frozenset(covered), frozenset(zero_width))
+
+
+def pdf_safe_text(text):
+    # Sans mémorisation : pour les chaînes éphémères (mesures de largeur, numéros de page)
+    if text.isascii():
+        return text
+    # NFC : "e" + accent combinant devient "é", présent dans la police
+    return unicodedata.normalize("NFC", text).translate(_translation_table())
+
+
+_clean_text = functools.lru_cache(maxsize=CLEAN_TEXT_CACHE_SIZE)(pdf_safe_text)
+
+
+def clean_text_for_pdf(text):
+    return _clean_text(str(text))
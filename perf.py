@@ -0,0 +1,246 @@
+"""Mesures de performance par étape de la génération des rapports.
+
+Chaque étape est entourée d'un ``span`` qui relève le temps réel, le temps CPU du thread,
+le pic mémoire (tracemalloc) et des compteurs (octets en entrée/sortie, images).
+Les spans d'une même génération sont regroupés dans un ``trace`` ; à sa clôture ils
+sont ajoutés à un fichier JSON-lines et les totaux par étape sont réécrits au format
+texte Prometheus. La mesure est désactivée par défaut (variable ORPI_PERF=1 ou ``enable()``).
+
+Les processus de calcul (génération des PDF) mesurent leurs étapes dans un ``remote_trace``
+portant l'identifiant de la génération du processus parent, puis lui renvoient leurs spans
+(``record_remote``) : seul le processus de l'application écrit les fichiers de mesures.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+PERF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "perf")
+SPANS_PATH = os.path.join(PERF_DIR, "spans.jsonl")
+PROMETHEUS_PATH = os.path.join(PERF_DIR, "metrics.prom")
+
+_enabled = os.environ.get("ORPI_PERF") == "1"
+_current_trace = contextvars.ContextVar("perf_trace", default=None)
+_lock = threading.Lock()
+_totals = {}
+_recent = deque(maxlen=200)
+_stack = threading.local()
+# Processus de calcul : spans renvoyés au parent, aucun fichier écrit
+_worker = False
+
+
+def enable(flag=True):
+    global _enabled
+    _enabled = flag
+    if flag and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not flag and tracemalloc.is_tracing():
+        # Le suivi ralentit chaque allocation du serveur : arrêté dès que la mesure est coupée
+        tracemalloc.stop()
+
+
+def is_enabled():
+    return _enabled
+
+
+def current_trace_id():
+    current = _current_trace.get()
+    return current.trace_id if current else None
+
+
+def worker_process():
+    global _worker
+    _worker = True
+
+
+class Span:
+    __slots__ = ('name', 'trace_id', 'started_at', 'wall_s', 'cpu_s', 'peak_mem_bytes', 'counters')
+
+    def __init__(self, name, trace_id, counters):
+        self.name = name
+        self.trace_id = trace_id
+        self.started_at = time.time()
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.peak_mem_bytes = 0
+        self.counters = dict(counters)
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def as_dict(self):
+        return {
+            "trace": self.trace_id,
+            "span": self.name,
+            "ts": datetime.fromtimestamp(self.started_at).isoformat(timespec="milliseconds"),
+            "wall_s": round(self.wall_s, 6),
+            "cpu_s": round(self.cpu_s, 6),
+            "peak_mem_bytes": self.peak_mem_bytes,
+            **self.counters,
+        }
+
+
+class _NullSpan:
+    def add(self, **counters):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    def __init__(self, name, trace_id=None, remote=False):
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans = []
+        self.closed = False
+        # Trace d'un processus de calcul : ses spans sont seulement collectés pour le parent
+        self.remote = remote
+
+
+@contextmanager
+def span(name, **counters):
+    if not _enabled:
+        yield _NULL_SPAN
+        return
+    trace = _current_trace.get()
+    current = Span(name, trace.trace_id if trace else None, counters)
+    tracing = tracemalloc.is_tracing()
+    stack = getattr(_stack, 'frames', None)
+    if stack is None:
+        stack = _stack.frames = []
+    if tracing:
+        start_mem, peak = tracemalloc.get_traced_memory()
+        # reset_peak() efface aussi le pic du span parent : on le lui reporte avant
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        frame = [start_mem, start_mem]
+        stack.append(frame)
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield current
+    finally:
+        current.wall_s = time.perf_counter() - wall_start
+        current.cpu_s = time.thread_time() - cpu_start
+        if tracing:
+            stack.pop()
+            peak = max(frame[1], tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            # Pic au-dessus de la mémoire déjà allouée à l'entrée (mesure globale au processus)
+            current.peak_mem_bytes = max(0, peak - frame[0])
+        _record(current, trace)
+
+
+@contextmanager
+def trace(name, trace_id=None):
+    # Regroupe les spans d'une génération ; les threads lancés avec copy_context() y contribuent.
+    # trace_id rattache une étape ultérieure (envoi du rapport) à une génération déjà close
+    current = Trace(name, trace_id)
+    token = _current_trace.set(current)
+    try:
+        with span(name):
+            yield current
+    finally:
+        _current_trace.reset(token)
+        with _lock:
+            current.closed = True
+            spans = list(current.spans)
+        _export(spans)
+
+
+@contextmanager
+def remote_trace(name, trace_id, enabled):
+    # Dans un processus de calcul : mesure selon l'état du parent au moment de la soumission,
+    # spans rattachés à sa génération et récupérés dans trace.spans pour record_remote()
+    enable(enabled)
+    current = Trace(name, trace_id, remote=True)
+    token = _current_trace.set(current)
+    try:
+        with span(name):
+            yield current
+    finally:
+        _current_trace.reset(token)
+        with _lock:
+            current.closed = True
+
+
+def record_remote(spans):
+    # Spans renvoyés par un processus de calcul : comptés et exportés par ce processus
+    if not spans:
+        return
+    with _lock:
+        for current in spans:
+            _account(current)
+    _export(spans)
+
+
+def _account(current):
+    # Appelé avec _lock acquis
+    _recent.append(current)
+    totals = _totals.setdefault(current.name, {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+    totals["count"] += 1
+    totals["wall_seconds"] += current.wall_s
+    totals["cpu_seconds"] += current.cpu_s
+    for key, value in current.counters.items():
+        totals[key] = totals.get(key, 0) + value
+
+
+def _record(current, trace):
+    with _lock:
+        if trace is not None and trace.remote:
+            if not trace.closed:
+                trace.spans.append(current)
+            return
+        _account(current)
+        if trace is not None and not trace.closed:
+            trace.spans.append(current)
+            return
+    # Span hors génération (normalisation en arrière-plan, envoi d'email...) : export immédiat
+    _export([current])
+
+
+def recent_spans():
+    with _lock:
+        return [s.as_dict() for s in _recent]
+
+
+def _export(spans):
+    # Un seul écrivain par fichier : les processus de calcul n'exportent rien
+    if not spans or _worker:
+        return
+    with _lock:
+        os.makedirs(PERF_DIR, exist_ok=True)
+        with open(SPANS_PATH, "a", encoding="utf-8") as f:
+            for s in spans:
+                f.write(json.dumps(s.as_dict(), ensure_ascii=False) + "\n")
+        _write_prometheus()
+
+
+def _write_prometheus():
+    lines = []
+    metrics = sorted({key for totals in _totals.values() for key in totals})
+    for metric in metrics:
+        name = f"orpi_stage_{metric}_total"
+        lines.append(f"# TYPE {name} counter")
+        for stage, totals in sorted(_totals.items()):
+            if metric in totals:
+                lines.append(f'{name}{{stage="{stage}"}} {totals[metric]}')
+    # Écriture atomique pour le collecteur "textfile" de node_exporter
+    tmp_path = PROMETHEUS_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, PROMETHEUS_PATH)
+
+
+if _enabled:
+    enable()
@@ -0,0 +1,104 @@
+"""Stockage des photos d'observation d'une session, borné en mémoire.
+
+Les photos (déjà normalisées et réduites) sont adressées par leur empreinte SHA-256.
+Au-delà du budget mémoire, les moins récemment utilisées sont déplacées dans une base
+SQLite temporaire ; une photo qui n'est plus référencée par aucune observation est libérée.
+"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+# Budget mémoire par session (octets de photos normalisées)
+SESSION_PHOTO_BUDGET_BYTES = 48 * 1024 * 1024
+
+
+def _remove_database(connection, path):
+    connection.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class PhotoStore:
+    def __init__(self, memory_budget=SESSION_PHOTO_BUDGET_BYTES, spill_dir=None):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._refcounts = {}
+        # Photos déplacées dans la base : empreinte -> taille
+        self._spilled = {}
+        self._spilled_bytes = 0
+        self._db = None
+        self._db_path = None
+        self._lock = threading.Lock()
+
+    def _database(self):
+        # La base n'est créée qu'au premier débordement
+        if self._db is None:
+            fd, self._db_path = tempfile.mkstemp(prefix="orpi-photos-", suffix=".sqlite", dir=self.spill_dir)
+            os.close(fd)
+            self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, data BLOB NOT NULL)")
+            # Supprime le fichier quand la session (et donc le store) disparaît
+            self._finalizer = weakref.finalize(self, _remove_database, self._db, self._db_path)
+        return self._db
+
+    def _spill(self):
+        while self._memory_bytes > self.memory_budget and self._memory:
+            key, data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(data)
+            db = self._database()
+            with db:
+                db.execute("INSERT OR REPLACE INTO blobs (key, data) VALUES (?, ?)", (key, data))
+            self._spilled[key] = len(data)
+            self._spilled_bytes += len(data)
+
+    def add(self, data):
+        key = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._refcounts[key] = self._refcounts.get(key, 0) + 1
+            if key not in self._memory and key not in self._spilled:
+                self._memory[key] = data
+                self._memory_bytes += len(data)
+                self._spill()
+        return key
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+            if key in self._spilled:
+                row = self._db.execute("SELECT data FROM blobs WHERE key = ?", (key,)).fetchone()
+                return row[0]
+        raise KeyError(key)
+
+    def release(self, key):
+        with self._lock:
+            count = self._refcounts.get(key, 0) - 1
+            if count > 0:
+                self._refcounts[key] = count
+                return
+            self._refcounts.pop(key, None)
+            data = self._memory.pop(key, None)
+            if data is not None:
+                self._memory_bytes -= len(data)
+            if key in self._spilled:
+                self._spilled_bytes -= self._spilled.pop(key)
+                with self._db:
+                    self._db.execute("DELETE FROM blobs WHERE key = ?", (key,))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "photos": len(self._refcounts),
+                "memory_bytes": self._memory_bytes,
+                "memory_budget": self.memory_budget,
+                "spilled": len(self._spilled),
+                "spilled_bytes": self._spilled_bytes,
+            }
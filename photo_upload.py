@@ -0,0 +1,112 @@
+"""Téléversement des photos avec réduction dans le navigateur.
+
+Le composant ``components/photo_upload`` redresse (orientation EXIF), réduit à la largeur
+de stockage et réencode en JPEG chaque photo sur le téléphone avant l'envoi : quelques
+centaines de Ko transitent au lieu des 3 à 10 Mo d'origine, et le serveur reçoit des
+octets prêts pour le PDF. Les photos que le navigateur ne sait pas décoder (HEIC hors
+Safari) sont envoyées telles quelles et normalisées côté serveur comme avant.
+
+Chaque photo n'est envoyée qu'une fois : ses octets sont gardés dans la session, et le
+composant remplace alors sa valeur par l'identifiant (empreinte SHA-256) de chaque photo.
+Streamlit renvoie la valeur de tous les widgets à chaque interaction ; sans ce relais, la
+photo principale repartirait du téléphone à chaque clic.
+
+La page du composant fonctionne aussi seule, hors de Streamlit : paramètres dans l'URL
+(``index.html?max_width_px=2244&quality=90``), résultat dans ``window.preparedPhotos``.
+``benchmarks/bench_upload.py`` s'en sert pour la tester dans un navigateur sans interface.
+"""
+import base64
+import os
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+from report_engine import QUALITY_PROFILES, STORAGE_PROFILE, STORAGE_WIDTH_MM, target_width_px
+
+PHOTO_UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "photo_upload")
+
+# Par défaut, les dimensions et la qualité de la version stockée des photos
+PHOTO_UPLOAD_MAX_WIDTH_PX = target_width_px(STORAGE_WIDTH_MM, STORAGE_PROFILE)
+PHOTO_UPLOAD_QUALITY = QUALITY_PROFILES[STORAGE_PROFILE]["quality"]
+
+_component = components.declare_component("photo_upload", path=PHOTO_UPLOAD_DIR)
+
+
+class PreparedPhoto:
+    # Même interface que les fichiers de st.file_uploader (name, type, size, getvalue) ;
+    # prepared indique que la photo a été redressée, réduite et réencodée par le navigateur
+    __slots__ = ('name', 'type', 'data', 'width', 'height', 'original_size', 'prepared')
+
+    def __init__(self, name, type, data, width=None, height=None, original_size=None, prepared=False):
+        self.name = name
+        self.type = type
+        self.data = data
+        self.width = width
+        self.height = height
+        self.original_size = original_size if original_size is not None else len(data)
+        self.prepared = prepared
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def getvalue(self):
+        return self.data
+
+
+def _uploads(key):
+    # Photos reçues par téléversement de la session : clé du widget -> {identifiant: photo ou None}
+    # (None : photo refusée, trop volumineuse)
+    return st.session_state.setdefault("_photo_uploads", {}).setdefault(key, {})
+
+
+def _receive(key, value):
+    # Décode les photos arrivant avec leurs octets ; celles déjà reçues ne sont plus qu'un identifiant
+    received = _uploads(key)
+    max_bytes = st.get_option("server.maxUploadSize") * 1024 * 1024
+    kept = {}
+    for photo in value or []:
+        photo_id = photo["id"]
+        if photo_id not in received and photo.get("data") is not None:
+            data = base64.b64decode(photo["data"])
+            if len(data) > max_bytes:
+                st.error(f"{photo['name']} dépasse la taille maximale de {max_bytes // 1024 // 1024} Mo")
+                received[photo_id] = None
+            else:
+                received[photo_id] = PreparedPhoto(photo["name"], photo["type"], data, photo.get("width"),
+                                                   photo.get("height"), photo.get("original_size"),
+                                                   photo.get("prepared", False))
+        if photo_id in received:
+            kept[photo_id] = received[photo_id]
+    # Photos retirées de la sélection : libérées
+    received.clear()
+    received.update(kept)
+    return [photo for photo in kept.values() if photo is not None]
+
+
+def _selection(photos, max_files):
+    if max_files == 1:
+        return photos[0] if photos else None
+    return photos
+
+
+def photo_uploader(label, key, max_files=None, max_width_px=PHOTO_UPLOAD_MAX_WIDTH_PX,
+                   quality=PHOTO_UPLOAD_QUALITY):
+    # max_files=1 : une seule photo (ou None), sinon une liste comme accept_multiple_files=True.
+    # La valeur du widget est lue avant de le dessiner, pour lui indiquer dès ce run quelles photos
+    # sont arrivées : il n'enverra plus que leurs identifiants
+    photos = _receive(key, st.session_state.get(key))
+    _component(label=label, max_files=max_files, max_width_px=max_width_px, quality=quality,
+               max_upload_mb=st.get_option("server.maxUploadSize"), received=list(_uploads(key)),
+               key=key, default=None)
+    return _selection(photos, max_files)
+
+
+def uploaded_photos(key, max_files=None):
+    # Photos du téléversement de clé key, lisibles depuis un callback de formulaire
+    return _selection(_receive(key, st.session_state.get(key)), max_files)
+
+
+def discard_uploads(key):
+    # Widget retiré de la page (formulaire validé ou annulé) : ses photos quittent la session
+    st.session_state.get("_photo_uploads", {}).pop(key, None)
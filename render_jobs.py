@@ -0,0 +1,216 @@
+"""Génération des rapports dans un pool de processus, hors du thread de l'interface.
+
+Chaque rapport est une tâche soumise à ``RenderJobQueue`` : la file est bornée, chaque tâche
+publie son avancement (observations mises en page) et peut être annulée, en attente comme
+en cours. Les sessions Streamlit interrogent l'état de leur tâche au lieu d'attendre
+``create_pdf`` : le calcul se répartit sur les cœurs et l'interface reste réactive.
+
+Une tâche peut porter un rappel ``on_done`` : la suite du rapport (historique, envoi par
+email, clôture du brouillon) s'exécute alors dans le processus parent dès la fin du calcul,
+que la session qui l'a soumise soit encore ouverte ou non. Le résultat du rappel est
+conservé avec la tâche, la session n'a plus qu'à l'afficher.
+
+Les processus du pool n'ont pas les caches de l'application : chaque tâche reçoit ce que
+``prepare_report`` a trouvé prêt dans le processus Streamlit (photo principale et sections
+mises en page dès l'ajout des observations) et, pour le reste, les octets des photos ;
+les sections manquantes sont mises en page dans le pool, pas sur le thread du script.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor
+
+import perf
+from report_engine import create_pdf
+
+logger = logging.getLogger(__name__)
+
+# Tâches acceptées en plus de celles en cours, et durée de conservation d'un résultat non récupéré
+RENDER_QUEUE_MAX_PENDING = 16
+RENDER_JOB_RETENTION_SECONDS = 15 * 60
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+# État partagé avec le processus parent, installé par l'initialiseur de chaque processus
+_progress_queue = None
+_cancelled_jobs = None
+
+
+def _init_worker(progress_queue, cancelled_jobs):
+    global _progress_queue, _cancelled_jobs
+    _progress_queue = progress_queue
+    _cancelled_jobs = cancelled_jobs
+    perf.worker_process()
+
+
+def _render(job_id, data, main_image, sections, signature, profile, perf_enabled=False, perf_trace_id=None):
+    # Exécuté dans un processus du pool ; la signature est déjà encodée, main_image et sections
+    # le sont aussi s'ils étaient dans les caches du parent (sinon octets et observations brutes).
+    # Les mesures suivent l'état du parent et reviennent avec le résultat, dans sa génération
+    errors = []
+
+    def progress(done, total):
+        if job_id in _cancelled_jobs:
+            raise RenderCancelled()
+        _progress_queue.put((job_id, done, total))
+
+    start = time.perf_counter()
+    with perf.remote_trace("render.job", perf_trace_id, perf_enabled) as trace:
+        progress(0, len(sections))
+        pdf = create_pdf(data, main_image, sections, signature, profile, on_error=errors.append, progress=progress)
+        with perf.span("pdf.output") as span:
+            pdf_output = pdf.output(dest='S')
+            span.add(bytes_out=len(pdf_output))
+    return {
+        "pdf": pdf_output,
+        "pages": pdf.page,
+        "duplicate_images": pdf.duplicate_images,
+        "errors": errors,
+        "elapsed": time.perf_counter() - start,
+        "spans": trace.spans,
+    }
+
+
+class RenderJobQueue:
+    def __init__(self, max_workers=None, max_pending=RENDER_QUEUE_MAX_PENDING):
+        self.max_workers = max_workers or os.cpu_count()
+        self.max_pending = max_pending
+        # spawn : pas de fork d'un serveur Streamlit multi-thread
+        context = multiprocessing.get_context("spawn")
+        self._manager = context.Manager()
+        self._progress = self._manager.Queue()
+        self._cancelled = self._manager.dict()
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                         initializer=_init_worker, initargs=(self._progress, self._cancelled))
+        # Suites des rapports (on_done) : hors du thread du pool, qui doit continuer à relever les
+        # autres tâches ; un seul thread, les écritures en base se succèdent de toute façon
+        self._delivery = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render-delivery")
+        self._jobs = {}
+        self._futures = {}
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._listener = threading.Thread(target=self._listen, name="render-progress", daemon=True)
+        self._listener.start()
+
+    def submit(self, data, main_image, sections, signature=None, profile="email", on_done=None):
+        # Lève queue.Full quand la file est pleine : l'appelant demande de réessayer plus tard.
+        # on_done(résultat) est appelé dans ce processus une fois le PDF prêt ; ce qu'il renvoie est
+        # publié dans le statut de la tâche ("delivery"), qui ne passe à "done" qu'après lui
+        with self._lock:
+            self._prune()
+            active = sum(1 for job in self._jobs.values() if job["state"] in ("pending", "running"))
+            if active >= self.max_workers + self.max_pending:
+                raise queue.Full()
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {"state": "pending", "done": 0, "total": len(sections), "error": None,
+                                  "result": None, "delivery": None,
+                                  "submitted_at": time.time(), "updated_at": time.time()}
+            # Mesure rattachée à la génération en cours de l'appelant, s'il y en a une
+            future = self._pool.submit(_render, job_id, data, main_image, sections, signature, profile,
+                                       perf.is_enabled(), perf.current_trace_id())
+            self._futures[job_id] = future
+            if on_done is not None:
+                self._callbacks[job_id] = on_done
+        future.add_done_callback(lambda f, job_id=job_id: self._finished(job_id, f))
+        return job_id
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return {}
+            status = dict(job)
+            status["position"] = sum(1 for other in self._jobs.values()
+                                     if other["state"] == "pending" and other["submitted_at"] < job["submitted_at"])
+            return status
+
+    def cancel(self, job_id):
+        with self._lock:
+            future = self._futures.get(job_id)
+            # PDF déjà prêt (suite du rapport en cours) : trop tard pour annuler
+            if future is None or future.done() or self._jobs[job_id]["state"] not in ("pending", "running"):
+                return False
+            # En cours : interrompue à la prochaine observation
+            self._cancelled[job_id] = True
+        # En attente : retirée de la file (le rappel de fin passe la tâche à "cancelled")
+        future.cancel()
+        return True
+
+    def forget(self, job_id):
+        # Le résultat a été récupéré : libère le PDF gardé en mémoire
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._futures.pop(job_id, None)
+            self._callbacks.pop(job_id, None)
+            self._cancelled.pop(job_id, None)
+
+    def _update(self, job_id, **fields):
+        # Appelé avec self._lock acquis
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.update(fields, updated_at=time.time())
+
+    def _finished(self, job_id, future):
+        spans = None
+        try:
+            result = future.result()
+            spans = result.pop("spans", None)
+            fields = {"state": "done", "result": result}
+        except (CancelledError, RenderCancelled):
+            fields = {"state": "cancelled"}
+        except Exception as e:
+            fields = {"state": "failed", "error": str(e)}
+        with self._lock:
+            on_done = self._callbacks.pop(job_id, None)
+        # Spans du processus de calcul : enregistrés ici, seul écrivain des fichiers de mesures
+        perf.record_remote(spans)
+        if fields["state"] == "done" and on_done is not None:
+            self._delivery.submit(self._deliver, job_id, fields, on_done)
+        else:
+            self._complete(job_id, fields)
+
+    def _deliver(self, job_id, fields, on_done):
+        try:
+            fields["delivery"] = on_done(fields["result"])
+        except Exception as e:
+            logger.exception("Suite du rapport %s en échec", job_id)
+            fields["error"] = str(e)
+        self._complete(job_id, fields)
+
+    def _complete(self, job_id, fields):
+        with self._lock:
+            if fields["state"] == "done" and job_id in self._jobs:
+                fields["done"] = self._jobs[job_id]["total"]
+            self._update(job_id, **fields)
+            self._futures.pop(job_id, None)
+
+    def _listen(self):
+        while True:
+            try:
+                job_id, done, total = self._progress.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None and job["state"] in ("pending", "running"):
+                    self._update(job_id, state="running", done=done, total=total)
+
+    def _prune(self):
+        # Appelé avec self._lock acquis : oublie les tâches terminées jamais récupérées
+        limit = time.time() - RENDER_JOB_RETENTION_SECONDS
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job["state"] not in ("pending", "running") and job["updated_at"] < limit]:
+            self._jobs.pop(job_id)
+            self._cancelled.pop(job_id, None)
+
+    def shutdown(self):
+        self._pool.shutdown(cancel_futures=True)
+        self._delivery.shutdown()
+        self._manager.shutdown()
@@ -0,0 +1,850 @@
+"""Moteur de rapport de visite, utilisable sans Streamlit.
+
+Une visite est décrite par un dictionnaire ``data`` (date, address, redacteur,
+personnes_presentes, arrival_time, departure_time, building_code) et une liste
+d'observations ``{"type", "description", "action", "photos"}``. Les photos et la
+signature peuvent être des octets, des fichiers téléversés Streamlit ou des chemins ;
+``prepare_report`` remplace par leur version déjà mise en page (ou en cours de préparation)
+la photo principale et les observations trouvées dans les caches du processus ;
+``create_pdf`` accepte ces versions comme les originaux, et prépare lui-même les autres.
+"""
+import contextvars
+import hashlib
+import logging
+import math
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from fpdf import FPDF
+from PIL import Image
+
+# Ajout du support HEIC
+from pillow_heif import register_heif_opener
+register_heif_opener()
+
+import perf
+from pdf_text import PDF_FONT_FAMILY, clean_text_for_pdf, install_font, pdf_safe_text
+
+logger = logging.getLogger(__name__)
+
+# Budget mémoire du cache des photos normalisées (partagé entre les reruns et les sessions)
+IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+class ImageCache:
+    # Cache LRU borné en octets : empreinte SHA-256 du fichier d'origine -> JPEG normalisé
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= len(previous)
+            self._entries[key] = value
+            self.current_bytes += size
+            # Éviction des entrées les moins récemment utilisées
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+# Profils de qualité des photos : résolution d'impression visée et qualité JPEG
+QUALITY_PROFILES = {
+    "email": {"dpi": 150, "quality": 75},
+    "archive": {"dpi": 300, "quality": 90},
+}
+DEFAULT_QUALITY_PROFILE = "email"
+
+# Largeur des emplacements photo dans le PDF (mm)
+MAIN_IMAGE_WIDTH_MM = 190
+OBS_IMAGE_WIDTH_MM = 100
+SIGNATURE_WIDTH_MM = 90
+
+# Signature : luminance en dessous de laquelle un pixel est de l'encre, nombre minimal de
+# pixels d'encre pour considérer le canevas signé, marge conservée autour du tracé (px)
+SIGNATURE_INK_THRESHOLD = 128
+SIGNATURE_MIN_INK_PIXELS = 40
+SIGNATURE_MARGIN_PX = 4
+
+# Version des photos d'observation conservée pendant la visite : assez grande pour tous les profils
+STORAGE_WIDTH_MM = MAIN_IMAGE_WIDTH_MM
+STORAGE_PROFILE = "archive"
+
+# Vignettes d'aperçu dans l'interface
+THUMBNAIL_WIDTH_PX = 320
+THUMBNAIL_QUALITY = 70
+
+def target_width_px(width_mm, profile):
+    return int(round(width_mm / 25.4 * QUALITY_PROFILES[profile]["dpi"]))
+
+class NormalizedImage:
+    # Image prête à être intégrée au PDF (JPEG par défaut), avec ses dimensions en pixels,
+    # l'empreinte de son contenu et celle de la photo d'origine (None si inconnue)
+    __slots__ = ('data', 'width', 'height', 'key', 'source_key', 'colorspace', 'bpc', 'filter')
+
+    def __init__(self, data, width, height, source_key=None, colorspace='DeviceRGB', bpc=8, filter='DCTDecode'):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.key = hashlib.sha256(data).hexdigest()
+        self.source_key = source_key
+        self.colorspace = colorspace
+        self.bpc = bpc
+        self.filter = filter
+
+    def __len__(self):
+        return len(self.data)
+
+def _exif_rotation(img):
+    try:
+        exif = img._getexif()
+        if exif is not None:
+            orientation = exif.get(274)  # 274 est le tag pour l'orientation
+            if orientation == 3:
+                return 180
+            elif orientation == 6:
+                return 270
+            elif orientation == 8:
+                return 90
+    except:
+        if img.width < img.height:
+            return 270
+    return 0
+
+def _normalize_image(image_data, target_px, quality):
+    img = Image.open(BytesIO(image_data))
+
+    # Si c'est une image HEIC, elle est déjà convertie en PIL Image par pillow-heif
+
+    rotation = _exif_rotation(img)
+    final_width = img.height if rotation in (90, 270) else img.width
+    scale = target_px / final_width
+    if scale < 1:
+        # Décodage JPEG à résolution réduite (mise à l'échelle DCT) ; sans effet pour les autres formats
+        img.draft('RGB', (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+        # Réduction entière rapide pour les formats sans décodage réduit (HEIC, PNG)
+        factor = (img.height if rotation in (90, 270) else img.width) // target_px
+        if factor >= 2 and img.mode in ('RGB', 'RGBA', 'L', 'LA'):
+            img = img.reduce(factor)
+
+    if rotation:
+        img = img.rotate(rotation, expand=True)
+
+    if img.width > target_px:
+        img = img.resize((target_px, max(1, round(img.height * target_px / img.width))),
+                         Image.LANCZOS, reducing_gap=3.0)
+
+    # Conversion en JPEG pour la compatibilité PDF
+    output_buffer = BytesIO()
+    if img.mode in ('RGBA', 'LA'):
+        background = Image.new(img.mode[:-1], img.size, 'white')
+        background.paste(img, img.split()[-1])
+        img = background
+    img.convert('RGB').save(output_buffer, format='JPEG', quality=quality, optimize=True)
+    return NormalizedImage(output_buffer.getvalue(), img.width, img.height)
+
+class ImageNormalizer:
+    # Normalise les photos en arrière-plan dès leur téléversement ;
+    # le décodage et l'encodage de Pillow libèrent le GIL, un pool de threads suffit
+    def __init__(self, cache, max_workers=None):
+        self.cache = cache
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or min(4, os.cpu_count() or 1),
+                                        thread_name_prefix="image-normalizer")
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _run(self, key, image_data, target_px, quality):
+        try:
+            with perf.span("image.normalize", images=1, bytes_in=len(image_data)) as span:
+                normalized = _normalize_image(image_data, target_px, quality)
+                span.add(bytes_out=len(normalized))
+            normalized.source_key = key.split(':')[0]
+            self.cache.put(key, normalized)
+            return normalized
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _submit(self, key, image_data, target_px, quality):
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                # Le contexte est copié pour rattacher la mesure à la génération en cours
+                future = self._pool.submit(contextvars.copy_context().run,
+                                           self._run, key, image_data, target_px, quality)
+                self._pending[key] = future
+            return future
+
+    def _key(self, image_data, target_px, quality):
+        # Une même photo peut être demandée pour plusieurs emplacements et profils
+        return f"{hashlib.sha256(image_data).hexdigest()}:{target_px}:{quality}"
+
+    def prefetch(self, image_data, target_px, quality):
+        key = self._key(image_data, target_px, quality)
+        if self.cache.get(key) is None:
+            self._submit(key, image_data, target_px, quality)
+
+    def adopt(self, image_data, width, height, target_px, quality):
+        # Photo déjà redressée, réduite et encodée à cette qualité (par le navigateur) :
+        # mise en cache comme sa propre version normalisée, sans décodage
+        key = self._key(image_data, target_px, quality)
+        normalized = NormalizedImage(image_data, width, height, source_key=key.split(':')[0])
+        self.cache.put(key, normalized)
+        return normalized
+
+    def lookup(self, image_data, target_px, quality):
+        # Version en cache, ou attendue si sa normalisation est en cours ; None sinon, sans rien lancer
+        key = self._key(image_data, target_px, quality)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        with self._lock:
+            future = self._pending.get(key)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception:
+            return None
+
+    def get(self, image_data, target_px, quality):
+        key = self._key(image_data, target_px, quality)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        # Attend la normalisation déjà lancée, ou la lance si la photo n'a jamais été vue
+        return self._submit(key, image_data, target_px, quality).result()
+
+_normalizer = None
+_normalizer_lock = threading.Lock()
+
+def get_image_normalizer():
+    # Un seul normaliseur par processus, partagé entre les reruns et les sessions Streamlit
+    global _normalizer
+    with _normalizer_lock:
+        if _normalizer is None:
+            _normalizer = ImageNormalizer(ImageCache(IMAGE_CACHE_MAX_BYTES))
+        return _normalizer
+
+def _read_bytes(image_file):
+    # Accepte des octets, un fichier téléversé Streamlit ou un chemin
+    if isinstance(image_file, (bytes, bytearray)):
+        return bytes(image_file)
+    if isinstance(image_file, (str, os.PathLike)):
+        with open(image_file, "rb") as f:
+            return f.read()
+    return image_file.getvalue()
+
+def _report_error(on_error, message):
+    if on_error is not None:
+        on_error(message)
+    else:
+        logger.warning(message)
+
+def prefetch_images(files, width_mm, profile=DEFAULT_QUALITY_PROFILE):
+    normalizer = get_image_normalizer()
+    target_px = target_width_px(width_mm, profile)
+    quality = QUALITY_PROFILES[profile]["quality"]
+    for f in files:
+        if f is not None:
+            normalizer.prefetch(_read_bytes(f), target_px, quality)
+
+def adopt_prepared_image(image_data, width, height, width_mm=STORAGE_WIDTH_MM, profile=STORAGE_PROFILE):
+    # None si la photo dépasse la largeur visée ou ne correspond pas à ce que le navigateur annonce :
+    # elle passe alors par la normalisation habituelle. Les octets adoptés vont tels quels dans le
+    # PDF (DCTDecode, DeviceRGB) : l'en-tête est vérifié, sans décoder l'image
+    target_px = target_width_px(width_mm, profile)
+    if not width or not height or width > target_px:
+        return None
+    try:
+        with Image.open(BytesIO(image_data)) as img:
+            if img.format != "JPEG" or img.mode != "RGB" or img.size != (width, height):
+                return None
+    except Exception:
+        return None
+    return get_image_normalizer().adopt(image_data, width, height, target_px, QUALITY_PROFILES[profile]["quality"])
+
+def fix_image_rotation(image_data, width_mm=MAIN_IMAGE_WIDTH_MM, profile=DEFAULT_QUALITY_PROFILE, on_error=None):
+    try:
+        return get_image_normalizer().get(image_data, target_width_px(width_mm, profile),
+                                          QUALITY_PROFILES[profile]["quality"])
+    except Exception as e:
+        _report_error(on_error, f"Erreur lors du traitement de l'image : {str(e)}")
+        return None
+
+def get_thumbnail(image_file, on_error=None):
+    # Vignette légère mise en cache par empreinte : l'aperçu ne renvoie jamais la photo d'origine
+    try:
+        return get_image_normalizer().get(_read_bytes(image_file), THUMBNAIL_WIDTH_PX, THUMBNAIL_QUALITY)
+    except Exception as e:
+        _report_error(on_error, f"Erreur lors de la création de l'aperçu : {str(e)}")
+        return None
+
+def get_full_preview(image_file, on_error=None):
+    # Photo redressée en haute définition, affichée uniquement à la demande
+    return fix_image_rotation(_read_bytes(image_file), STORAGE_WIDTH_MM, STORAGE_PROFILE, on_error)
+
+def _signature_luminance(signature):
+    # Tableau du canevas (ou image décodée) -> niveaux de gris composés sur fond blanc
+    if isinstance(signature, np.ndarray):
+        pixels = signature
+    else:
+        with Image.open(BytesIO(_read_bytes(signature))) as img:
+            pixels = np.asarray(img.convert("RGBA"))
+    pixels = pixels.astype(np.float32)
+    if pixels.ndim == 2:
+        return pixels
+    gray = pixels[..., :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    if pixels.shape[-1] == 4:
+        # Le canevas peut être transparent hors du tracé
+        alpha = pixels[..., 3] / 255
+        gray = gray * alpha + 255 * (1 - alpha)
+    return gray
+
+def _ink_box(gray):
+    # Boîte englobante de l'encre (haut, bas, gauche, droite), None si le canevas est vide
+    ink = gray < SIGNATURE_INK_THRESHOLD
+    if np.count_nonzero(ink) < SIGNATURE_MIN_INK_PIXELS:
+        return None
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+def is_signature_blank(signature):
+    return _ink_box(_signature_luminance(signature)) is None
+
+def _signature_key(signature, target_px):
+    if isinstance(signature, np.ndarray):
+        digest = hashlib.sha256(np.ascontiguousarray(signature).tobytes())
+        digest.update(str(signature.shape).encode())
+    else:
+        digest = hashlib.sha256(_read_bytes(signature))
+    return f"signature:{digest.hexdigest()}:{target_px}"
+
+def _encode_signature(signature, target_px):
+    gray = _signature_luminance(signature)
+    box = _ink_box(gray)
+    if box is None:
+        return None
+    top, bottom, left, right = box
+    height, width = gray.shape
+    crop = gray[max(0, top - SIGNATURE_MARGIN_PX):min(height, bottom + SIGNATURE_MARGIN_PX),
+                max(0, left - SIGNATURE_MARGIN_PX):min(width, right + SIGNATURE_MARGIN_PX)]
+    img = Image.fromarray(crop.astype(np.uint8), "L")
+    # Mise à l'échelle du profil avant le seuillage : contours lissés, même taille physique qu'avant
+    scale = target_px / width
+    if scale != 1:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    bits = np.asarray(img) >= SIGNATURE_INK_THRESHOLD
+    # Noir et blanc 1 bit (1 = blanc), lignes complétées à l'octet comme l'attend le PDF
+    data = zlib.compress(np.packbits(bits, axis=1).tobytes(), 9)
+    return NormalizedImage(data, img.width, img.height, colorspace='DeviceGray', bpc=1, filter='FlateDecode')
+
+def normalize_signature(signature_image, profile=DEFAULT_QUALITY_PROFILE, on_error=None):
+    # Signature recadrée sur le tracé et encodée en 1 bit, mise en cache par empreinte du canevas
+    if isinstance(signature_image, NormalizedImage):
+        return signature_image
+    try:
+        target_px = target_width_px(SIGNATURE_WIDTH_MM, profile)
+        cache = get_image_normalizer().cache
+        key = _signature_key(signature_image, target_px)
+        signature = cache.get(key)
+        if signature is None:
+            signature = _encode_signature(signature_image, target_px)
+            if signature is None:
+                _report_error(on_error, "La signature est vide.")
+                return None
+            cache.put(key, signature)
+        return signature
+    except Exception as e:
+        _report_error(on_error, f"Erreur lors du traitement de la signature : {str(e)}")
+        return None
+
+def signature_width_mm(signature, profile=DEFAULT_QUALITY_PROFILE):
+    return SIGNATURE_WIDTH_MM * signature.width / target_width_px(SIGNATURE_WIDTH_MM, profile)
+
+class _PDFBuffer(BytesIO):
+    # FPDF calcule les offsets des objets avec len(self.buffer)
+    def __len__(self):
+        return self.tell()
+
+class ReportPDF(FPDF):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Nombre de placements d'images servis par une image déjà intégrée
+        self.duplicate_images = 0
+        self._source_images = {}
+        # Document écrit directement en octets, au lieu d'une chaîne latin1 recopiée à chaque ajout
+        self.buffer = _PDFBuffer()
+
+    def _out(self, s):
+        if self.state == 2:
+            # Contenu de la page courante : reste une chaîne, compressé par page à la fin
+            super()._out(s)
+            return
+        if isinstance(s, str):
+            s = s.encode("latin1")
+        elif not isinstance(s, (bytes, bytearray)):
+            s = str(s).encode("latin1")
+        # Les flux d'images sont écrits tels quels, sans décodage intermédiaire
+        self.buffer.write(s)
+        self.buffer.write(b"\n")
+
+    def set_font(self, family, style='', size=0):
+        # Les styles de la police Unicode sont intégrés à leur premier usage
+        if family == PDF_FONT_FAMILY:
+            install_font(self, style.upper().replace('U', ''))
+        super().set_font(family, style, size)
+
+    def normalize_text(self, txt):
+        # Toute chaîne dessinée ou mesurée : caractères absents de la police remplacés
+        return pdf_safe_text(str(txt))
+
+    def output(self, name='', dest=''):
+        # 'S' renvoie les octets du document sans copie ; 'F' les écrit dans le fichier name
+        if self.state < 3:
+            self.close()
+        dest = dest.upper() or ('F' if name else 'S')
+        if dest == 'S':
+            return self.buffer.getvalue()
+        if dest == 'F':
+            with open(name, 'wb') as f, self.buffer.getbuffer() as view:
+                f.write(view)
+            return ''
+        self.error('Incorrect output destination: ' + dest)
+
+    def header(self):
+        self.set_fill_color(227, 31, 43)
+        self.rect(10, 10, 40, 15, 'F')  # Width changée de 30 à 40
+        self.set_text_color(255, 255, 255)
+        self.set_font(PDF_FONT_FAMILY, 'B', 12)
+        self.text(12, 20, 'ORPI Adimmo')  # Position X ajustée de 15 à 12
+        
+        self.set_text_color(0, 0, 0)
+        self.set_font(PDF_FONT_FAMILY, 'B', 16)
+        self.cell(0, 10, 'RAPPORT DE VISITE', 0, 1, 'C')
+        self.ln(10)
+    
+    def footer(self):
+        self.set_y(-15)
+        self.set_font(PDF_FONT_FAMILY, 'I', 8)
+        self.set_text_color(128, 128, 128)
+        self.cell(0, 10, f'Page {self.page_no()}/{{nb}}', 0, 0, 'C')
+
+    def image_bytes(self, image, x=None, y=None, w=0, h=0):
+        # Intègre une image encodée en mémoire : pas de fichier temporaire, dimensions déjà connues.
+        # Les images sont indexées par empreinte : une image répétée n'est stockée qu'une fois
+        name = image.key
+        # Même photo d'origine déjà intégrée dans une résolution au moins égale : on la réutilise
+        alias = self._source_images.get(image.source_key)
+        if alias is not None and self.images[alias]['w'] >= image.width:
+            name = alias
+        if name in self.images:
+            self.duplicate_images += 1
+        else:
+            self.images[name] = {'i': len(self.images) + 1, 'w': image.width, 'h': image.height,
+                                 'cs': image.colorspace, 'bpc': image.bpc, 'f': image.filter, 'data': image.data}
+            if image.source_key is not None:
+                self._source_images[image.source_key] = name
+        self.image(name, x, y, w, h)
+
+# Sections d'observation pré-rendues : budget du cache et hauteur utile de la page (mm)
+SECTION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+PAGE_BREAK_Y = 277
+TEXT_WIDTH_MM = 190
+
+# Grille des photos d'observation : au plus 3 photos par ligne, réparties selon leurs proportions (mm)
+PHOTOS_PER_ROW_MAX = 3
+PHOTO_GRID_GAP_MM = 5
+PHOTO_ROW_MIN_HEIGHT_MM = 40
+PHOTO_ROW_MAX_HEIGHT_MM = 85
+
+class ObservationSection:
+    # Mise en page d'une observation, indépendante de sa position dans le rapport :
+    # une liste de lignes (hauteur, opérations de dessin relatives au haut de la ligne)
+    __slots__ = ('rows',)
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __len__(self):
+        # Les images comptent aussi : une fois évincées du cache des photos, c'est la section
+        # qui les garde en mémoire
+        return 1024 + sum(len(ops) * 64 + sum(len(op[1]) for op in ops if op[0] == 'image')
+                          for _, ops in self.rows)
+
+_measure = threading.local()
+
+def _wrap_lines(text, style, size, width=TEXT_WIDTH_MM):
+    # Découpe le texte comme FPDF.multi_cell, avec les métriques de la police du rapport
+    pdf = getattr(_measure, 'pdf', None)
+    if pdf is None:
+        pdf = _measure.pdf = ReportPDF()
+    pdf.set_font(PDF_FONT_FAMILY, style, size)
+    max_width = width - 2 * pdf.c_margin
+    text = text.replace('\r', '')
+    if text.endswith('\n'):
+        text = text[:-1]
+    lines = []
+    for paragraph in text.split('\n'):
+        line = ''
+        for word in paragraph.split(' '):
+            candidate = f"{line} {word}" if line else word
+            if pdf.get_string_width(candidate) <= max_width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            # Mot plus long qu'une ligne : coupure au caractère
+            line = ''
+            for char in word:
+                if line and pdf.get_string_width(line + char) > max_width:
+                    lines.append(line)
+                    line = ''
+                line += char
+        lines.append(line)
+    return lines
+
+def _text_rows(text, style='', size=10, line_height=7):
+    return [(line_height, [('font', PDF_FONT_FAMILY, style, size), ('color', 0, 0, 0),
+                           ('text', 10, 0, 0, line_height, line, 'L')])
+            for line in _wrap_lines(text, style, size)]
+
+def _row_splits(count):
+    # Toutes les façons de découper `count` photos consécutives en lignes d'au plus 3 photos
+    if count == 0:
+        yield ()
+        return
+    for size in range(min(count, PHOTOS_PER_ROW_MAX), 0, -1):
+        for rest in _row_splits(count - size):
+            yield (size,) + rest
+
+def _photo_grid(ratios, width=TEXT_WIDTH_MM):
+    # Proportions largeur/hauteur -> lignes [(hauteur, [(index, x, largeur), ...])].
+    # Chaque ligne remplit la largeur sans dépasser la hauteur maximale ; on retient le découpage
+    # le plus court dont toutes les lignes restent lisibles
+    best = None
+    for split in _row_splits(len(ratios)):
+        rows, start = [], 0
+        for size in split:
+            row = range(start, start + size)
+            start += size
+            gaps = PHOTO_GRID_GAP_MM * (size - 1)
+            # Aucune photo plus large que l'emplacement historique : la version préparée à
+            # OBS_IMAGE_WIDTH_MM reste assez définie pour toutes les dispositions
+            height = min((width - gaps) / sum(ratios[i] for i in row), PHOTO_ROW_MAX_HEIGHT_MM,
+                         OBS_IMAGE_WIDTH_MM / max(ratios[i] for i in row))
+            # Ligne bridée : centrée
+            x = 10 + (width - gaps - height * sum(ratios[i] for i in row)) / 2
+            placements = []
+            for i in row:
+                placements.append((i, x, height * ratios[i]))
+                x += height * ratios[i] + PHOTO_GRID_GAP_MM
+            rows.append((height, placements))
+        total = sum(height for height, _ in rows)
+        score = (any(height < PHOTO_ROW_MIN_HEIGHT_MM for height, _ in rows), total)
+        if best is None or score < best[0]:
+            best = (score, rows)
+    return best[1] if best else []
+
+def _section_key(obs, photos, profile):
+    digest = hashlib.sha256()
+    for value in (obs['type'], obs['description'], obs.get('action') or '', profile):
+        digest.update(str(value).encode('utf-8'))
+        digest.update(b'\0')
+    for photo in photos:
+        digest.update(hashlib.sha256(photo).digest())
+    return digest.hexdigest()
+
+def _build_observation_section(obs, photos, profile, errors):
+    obs_type_clean = clean_text_for_pdf(obs['type'])
+    obs_type = "Positive" if "Positive" in obs_type_clean else "A améliorer"  # Changé "Negative" en "A améliorer"
+    if obs_type == "Positive":
+        header_color = (0, 150, 0)  # Vert pour positif
+    else:
+        header_color = (200, 0, 0)  # Rouge pour négatif
+
+    # Espacement, cadre gris clair avec l'en-tête, puis titre "Description :"
+    rows = [(46, [
+        ('fill', 245, 245, 245),
+        ('rect', 10, 20, 190, 10),
+        ('font', PDF_FONT_FAMILY, 'B', 12),
+        ('color', *header_color),
+        ('title', 15, 22, 0, 8, f"Observation {{number}} - {obs_type}", 'L'),
+        ('font', PDF_FONT_FAMILY, 'B', 11),
+        ('color', 0, 0, 0),
+        ('text', 10, 38, 0, 8, "Description :", 'L'),
+    ])]
+    rows += _text_rows(clean_text_for_pdf(obs['description']))
+
+    # Action à mener (si elle existe)
+    if obs.get('action'):
+        rows.append((16, [('font', PDF_FONT_FAMILY, 'B', 11), ('color', 0, 0, 0),
+                          ('text', 10, 8, 0, 8, "Action à mener :", 'L')]))
+        rows += _text_rows(clean_text_for_pdf(obs['action']))
+
+    # Espacement avant les photos
+    rows.append((8, []))
+
+    # Photos de l'observation
+    if photos:
+        rows.append((10, [('font', PDF_FONT_FAMILY, 'B', 11), ('color', 0, 0, 0),
+                          ('text', 10, 0, 0, 8, "Photos :", 'L')]))
+        placed = []
+        for photo in photos:
+            corrected_image = fix_image_rotation(photo, OBS_IMAGE_WIDTH_MM, profile, errors.append)
+            if corrected_image is not None:
+                placed.append(corrected_image)
+        for height, placements in _photo_grid([image.width / image.height for image in placed]):
+            ops = []
+            for i, x, width in placements:
+                ops.append(('image', placed[i], x, 0, width, height))
+            rows.append((height + PHOTO_GRID_GAP_MM, ops))
+    return ObservationSection(rows)
+
+_section_cache = ImageCache(SECTION_CACHE_MAX_BYTES)
+_section_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="section-prerender")
+# Sections en cours de pré-rendu, par clé : prepare_report les attend au lieu de les refaire
+_section_pending = {}
+_section_lock = threading.Lock()
+
+def render_observation_section(obs, profile=DEFAULT_QUALITY_PROFILE, on_error=None):
+    photos = [_read_bytes(photo) for photo in obs['photos']]
+    key = _section_key(obs, photos, profile)
+    section = _section_cache.get(key)
+    if section is not None:
+        return section
+    errors = []
+    with perf.span("pdf.section", images=len(photos)):
+        section = _build_observation_section(obs, photos, profile, errors)
+    for error in errors:
+        _report_error(on_error, error)
+    # Une section incomplète n'est pas gardée : la prochaine génération réessaiera les photos
+    if not errors:
+        _section_cache.put(key, section)
+    return section
+
+def prerender_observation(obs, profile=DEFAULT_QUALITY_PROFILE):
+    # Prépare la section dès l'ajout ou la modification de l'observation ;
+    # "Générer" n'aura plus qu'à l'assembler
+    key = _section_key(obs, [_read_bytes(photo) for photo in obs['photos']], profile)
+    with _section_lock:
+        future = _section_pending.get(key)
+        if future is not None:
+            return future
+        future = _section_pool.submit(contextvars.copy_context().run, render_observation_section, obs, profile)
+        _section_pending[key] = future
+    future.add_done_callback(lambda f, key=key: _section_pending.pop(key, None))
+    return future
+
+def _prepared_section(obs, profile):
+    # Section en cache, ou attendue si son pré-rendu est en cours ; None sinon, sans rien lancer
+    photos = [_read_bytes(photo) for photo in obs['photos']]
+    key = _section_key(obs, photos, profile)
+    section = _section_cache.get(key)
+    if section is not None:
+        return section
+    with _section_lock:
+        future = _section_pending.get(key)
+    if future is None:
+        return None
+    try:
+        future.result()
+    except Exception:
+        return None
+    # Section incomplète (photo en erreur) : pas en cache, elle sera refaite et l'erreur signalée
+    return _section_cache.get(key)
+
+def prepare_report(main_image_file, observations, profile=DEFAULT_QUALITY_PROFILE):
+    # Remplace ce qui est déjà prêt dans les caches du processus (ou en cours de préparation) par
+    # sa version mise en page ; le reste est laissé tel quel, en octets, et sera préparé par
+    # create_pdf, dans le processus qui l'appelle. Ne normalise ni ne met en page rien ici
+    with perf.span("report.prepare") as span:
+        main_image = None
+        if main_image_file is not None:
+            main_image = _read_bytes(main_image_file)
+            main_image = get_image_normalizer().lookup(main_image, target_width_px(MAIN_IMAGE_WIDTH_MM, profile),
+                                                       QUALITY_PROFILES[profile]["quality"]) or main_image
+        sections = []
+        for obs in observations:
+            section = _prepared_section(obs, profile)
+            sections.append(section if section is not None
+                            else dict(obs, photos=[_read_bytes(photo) for photo in obs['photos']]))
+        span.add(sections=len(sections),
+                 cached_sections=sum(isinstance(section, ObservationSection) for section in sections))
+    return main_image, sections
+
+def draw_section(pdf, section, number):
+    y = pdf.get_y()
+    for height, ops in section.rows:
+        # Saut de page seulement si la ligne ne tient pas dans la page
+        if y + height > PAGE_BREAK_Y and y > pdf.t_margin + 20:
+            pdf.add_page()
+            y = pdf.get_y()
+        for op in ops:
+            kind = op[0]
+            if kind == 'font':
+                pdf.set_font(*op[1:])
+            elif kind == 'color':
+                pdf.set_text_color(*op[1:])
+            elif kind == 'fill':
+                pdf.set_fill_color(*op[1:])
+            elif kind == 'rect':
+                _, x, dy, w, h = op
+                pdf.rect(x, y + dy, w, h, 'F')
+            elif kind in ('text', 'title'):
+                _, x, dy, w, h, text, align = op
+                if kind == 'title':
+                    text = text.format(number=number)
+                pdf.set_xy(x, y + dy)
+                pdf.cell(w, h, text, 0, 0, align)
+            elif kind == 'image':
+                _, image, x, dy, w, h = op
+                pdf.image_bytes(image, x=x, y=y + dy, w=w, h=h)
+        y += height
+    pdf.set_xy(pdf.l_margin, y)
+
+def create_pdf(data, main_image_file, observations, signature_image=None, profile=DEFAULT_QUALITY_PROFILE,
+               on_error=None, progress=None):
+    # progress(fait, total) est appelé après chaque observation ; il peut lever une exception pour interrompre
+    with perf.span("pdf.layout") as span:
+        pdf = _layout_pdf(data, main_image_file, observations, signature_image, profile, on_error, progress)
+        span.add(pages=pdf.page, images=len(pdf.images), duplicate_images=pdf.duplicate_images)
+    return pdf
+
+def _layout_pdf(data, main_image_file, observations, signature_image, profile, on_error, progress=None):
+   pdf = ReportPDF()
+   pdf.alias_nb_pages()
+   pdf.add_page()
+   
+   # Informations principales
+   pdf.set_fill_color(240, 240, 240)
+   pdf.rect(10, 40, 190, 70, 'F')  # Hauteur augmentée pour personnes présentes
+   pdf.set_font(PDF_FONT_FAMILY, 'B', 12)
+   pdf.set_xy(15, 45)
+   
+   col_width = 90
+   line_height = 8
+   
+   # Mise en page en colonnes
+   pdf.set_font(PDF_FONT_FAMILY, 'B', 10)
+   pdf.cell(25, line_height, 'Date:', 0, 0)
+   pdf.set_font(PDF_FONT_FAMILY, '', 10)
+   pdf.cell(65, line_height, f"{data['date']}", 0, 0)
+   
+   pdf.set_font(PDF_FONT_FAMILY, 'B', 10)
+   pdf.cell(35, line_height, 'Rédacteur:', 0, 0)
+   pdf.set_font(PDF_FONT_FAMILY, '', 10)
+   pdf.cell(55, line_height, f"{data['redacteur']}", 0, 1)
+   
+   pdf.set_x(15)
+   pdf.set_font(PDF_FONT_FAMILY, 'B', 10)
+   pdf.cell(25, line_height, 'Adresse:', 0, 0)
+   pdf.set_font(PDF_FONT_FAMILY, '', 10)
+   pdf.cell(65, line_height, f"{data['address']}", 0, 1)
+   
+   # Heure d'arrivée
+   pdf.set_x(15)
+   pdf.set_font(PDF_FONT_FAMILY, 'B', 10)
+   pdf.cell(35, line_height, "Heure d'arrivée:", 0, 0)
+   pdf.set_font(PDF_FONT_FAMILY, '', 10)
+   pdf.cell(65, line_height, f"{data['arrival_time']}", 0, 1)
+   
+   # Heure de départ
+   pdf.set_x(15)
+   pdf.set_font(PDF_FONT_FAMILY, 'B', 10)
+   pdf.cell(35, line_height, "Heure de départ:", 0, 0)
+   pdf.set_font(PDF_FONT_FAMILY, '', 10)
+   pdf.cell(65, line_height, f"{data['departure_time']}", 0, 1)
+   
+   pdf.set_x(15)
+   pdf.set_font(PDF_FONT_FAMILY, 'B', 10)
+   pdf.cell(25, line_height, 'Code:', 0, 0)
+   pdf.set_font(PDF_FONT_FAMILY, '', 10)
+   pdf.cell(65, line_height, f"{data['building_code']}", 0, 1)
+
+   # Ajout des personnes présentes
+   if data.get('personnes_presentes'):  # Vérifie si le champ n'est pas vide
+       pdf.set_x(15)
+       pdf.set_font(PDF_FONT_FAMILY, 'B', 10)
+       pdf.cell(45, line_height, 'Personnes présentes:', 0, 0)
+       pdf.set_font(PDF_FONT_FAMILY, '', 10)
+       pdf.multi_cell(0, line_height, f"{data['personnes_presentes']}")
+   
+   # Image principale
+   if main_image_file is not None:
+       # Corriger la rotation (sauf image déjà préparée à la taille de l'emplacement)
+       corrected_image = main_image_file if isinstance(main_image_file, NormalizedImage) else \
+           fix_image_rotation(_read_bytes(main_image_file), MAIN_IMAGE_WIDTH_MM, profile, on_error)
+       if corrected_image is not None:
+           aspect = corrected_image.height / corrected_image.width
+           width = MAIN_IMAGE_WIDTH_MM
+           height = width * aspect
+           pdf.image_bytes(corrected_image, x=10, y=120, w=width, h=height)  # Y ajusté pour tenir compte des personnes présentes
+   
+   # Observations
+   pdf.add_page()
+   pdf.set_font(PDF_FONT_FAMILY, 'B', 14)
+   pdf.set_fill_color(227, 31, 43)
+   pdf.set_text_color(255, 255, 255)
+   pdf.cell(0, 10, 'OBSERVATIONS', 1, 1, 'C', True)
+   pdf.set_text_color(0, 0, 0)
+   
+   for idx, obs in enumerate(observations):
+       # Section déjà mise en page (rapport assemblé dans un autre processus) ou observation brute
+       section = obs if isinstance(obs, ObservationSection) else render_observation_section(obs, profile, on_error)
+       draw_section(pdf, section, idx + 1)
+       if progress is not None:
+           progress(idx + 1, len(observations))
+
+   # Page de signature
+   pdf.add_page()
+   pdf.set_font(PDF_FONT_FAMILY, 'B', 12)
+   pdf.cell(0, 10, "VALIDATION DU RAPPORT", 0, 1, 'C')
+   pdf.ln(5)
+   
+   pdf.set_font(PDF_FONT_FAMILY, 'B', 11)
+   pdf.cell(0, 10, data['redacteur'], 0, 1, 'C')
+   pdf.set_font(PDF_FONT_FAMILY, '', 10)
+   pdf.cell(0, 5, "Gestionnaire de copropriété", 0, 1, 'C')
+   
+   if signature_image is not None:
+       signature = normalize_signature(signature_image, profile, on_error)
+       if signature is not None:
+           # Tracé recadré : centré à l'emplacement de l'ancien cadre de 90 mm
+           w = signature_width_mm(signature, profile)
+           pdf.image_bytes(signature, x=105 - w / 2, y=pdf.get_y() + 10, w=w)
+   
+   return pdf
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# Modules de l'application importés depuis la racine du dépôt, comme dans benchmarks/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import streamlit as st  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from draft_journal import DraftJournal  # noqa: E402
+from visit_analytics import VisitAnalytics  # noqa: E402
+from visit_history import VisitHistory  # noqa: E402
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # Bases de l'application dans un répertoire temporaire, ressources recréées à chaque test
+    for cls, name in ((DraftJournal, "brouillons.sqlite"), (VisitHistory, "historique.sqlite"),
+                      (VisitAnalytics, "analytics")):
+        defaults = cls.__init__.__defaults__
+        monkeypatch.setattr(cls.__init__, "__defaults__", (str(tmp_path / name),) + defaults[1:])
+    st.cache_resource.clear()
+    yield lambda: AppTest.from_file(APP_PATH, default_timeout=60).run()
+    st.cache_resource.clear()
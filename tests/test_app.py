@@ -0,0 +1,38 @@
+"""Parcours de l'application avec le banc d'essai de Streamlit (AppTest)."""
+from draft_journal import DraftJournal
+
+
+def fill_visit(at, address, building_code):
+    at.text_input(key="address").input(address)
+    at.text_input(key="building_code").input(building_code).run()
+
+
+def click(at, label):
+    at.button[[button.label for button in at.button].index(label)].click().run()
+
+
+def test_generate_without_main_photo_asks_for_a_signature(app):
+    at = app()
+    fill_visit(at, "12 rue de l'Église", "1234")
+
+    click(at, "Générer le rapport PDF")
+
+    assert not at.exception
+    assert [error.value for error in at.error] == ["Veuillez signer le document avant de générer le PDF"]
+
+
+def test_restoring_a_draft_discards_the_session_draft(app, tmp_path):
+    lost = app()
+    fill_visit(lost, "12 rue de l'Église", "1234")
+    restoring = app()
+    restoring.text_input(key="building_code").input("1234").run()
+
+    click(restoring, "Restaurer le brouillon")
+
+    assert restoring.session_state["address"] == "12 rue de l'Église"
+    assert restoring.session_state["draft_id"] == lost.session_state["draft_id"]
+    # Seul le brouillon restauré reste proposé pour cet immeuble
+    journal = DraftJournal(str(tmp_path / "brouillons.sqlite"))
+    assert journal.find_draft("1234", exclude_draft_id="nouvelle session")[0] == lost.session_state["draft_id"]
+    journal.finalize(lost.session_state["draft_id"])
+    assert journal.find_draft("1234", exclude_draft_id="nouvelle session") is None
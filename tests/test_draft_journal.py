@@ -0,0 +1,44 @@
+"""Journal des brouillons : remplacement par une restauration et purge des visites abandonnées."""
+import time
+
+import pytest
+
+from draft_journal import DRAFT_RETENTION_SECONDS, DraftJournal
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return DraftJournal(str(tmp_path / "brouillons.sqlite"))
+
+
+def record_visit(journal, draft_id, building_code, photo_key):
+    journal.record_field(draft_id, "building_code", building_code)
+    obs = {"id": photo_key, "type": "✅ Positive", "description": "d", "action": "", "photos": [photo_key]}
+    journal.record_observation(draft_id, obs, {photo_key: b"jpeg " + photo_key.encode()})
+
+
+def test_discarded_draft_is_no_longer_offered(journal):
+    record_visit(journal, "restaure", "1234", "cle")
+    journal.record_field("remplace", "building_code", "1234")
+
+    journal.discard("remplace")
+
+    assert journal.find_draft("1234", exclude_draft_id="session")[0] == "restaure"
+    journal.finalize("restaure")
+    assert journal.find_draft("1234", exclude_draft_id="session") is None
+    assert journal.get_photo("cle") is None
+
+
+def test_purge_drops_abandoned_drafts_and_their_photos(journal, monkeypatch):
+    record_visit(journal, "abandonne", "1234", "ancienne")
+    later = time.time() + DRAFT_RETENTION_SECONDS + 60
+    monkeypatch.setattr(time, "time", lambda: later)
+    record_visit(journal, "recent", "5678", "recente")
+
+    assert journal.purge() == 1
+
+    assert journal.find_draft("1234") is None
+    assert journal.load_draft("abandonne") == ({}, [])
+    assert journal.get_photo("ancienne") is None
+    assert journal.find_draft("5678")[0] == "recent"
+    assert journal.get_photo("recente") == b"jpeg recente"
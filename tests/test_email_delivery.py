@@ -0,0 +1,108 @@
+"""File d'envoi des emails face à un serveur SMTP local (aiosmtpd).
+
+aiosmtpd n'est utile qu'aux tests, il ne fait pas partie de requirements.txt :
+    pip install aiosmtpd pytest && pytest tests
+"""
+import socket
+import time
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from email_delivery import EmailDeliveryQueue, build_report_email
+
+
+class RecordingHandler:
+    # Garde chaque session (une par connexion) et peut refuser les premiers messages
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.sessions = []
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.failures:
+            self.failures -= 1
+            return "451 Erreur temporaire"
+        self.sessions.append(session)
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    controllers = []
+
+    def start(handler):
+        controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+        controller.start()
+        controllers.append(controller)
+        return controller
+
+    yield start
+    for controller in controllers:
+        controller.stop(no_assert=True)
+
+
+def make_queue(controller, **kwargs):
+    config = {"smtp_server": controller.hostname, "smtp_port": controller.port, "use_ssl": False}
+    return EmailDeliveryQueue(config, backoff_seconds=0.01, **kwargs)
+
+
+def submit_report(email_queue, date="2024-03-18"):
+    return email_queue.submit(
+        lambda: build_report_email(b"%PDF-1.3", date, "12 rue de l'Église", "Elodie BONNAY", "syndic@example.com"),
+        f"Rapport de visite - {date}",
+    )
+
+
+def wait_for(email_queue, message_id, states=("sent", "failed"), timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = email_queue.status(message_id)
+        if status.get("state") in states:
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"envoi toujours {email_queue.status(message_id)}")
+
+
+def test_messages_reuse_one_connection(smtp_server):
+    handler = RecordingHandler()
+    email_queue = make_queue(smtp_server(handler))
+    message_ids = [submit_report(email_queue, f"2024-03-{day:02d}") for day in range(10, 15)]
+
+    statuses = [wait_for(email_queue, message_id) for message_id in message_ids]
+
+    assert [status["state"] for status in statuses] == ["sent"] * 5
+    assert len(handler.messages) == 5
+    assert len({id(session) for session in handler.sessions}) == 1
+    assert handler.messages[0].rcpt_tos == ["ebonnay@orpi.com"]
+
+
+def test_temporary_error_is_retried(smtp_server):
+    handler = RecordingHandler(failures=1)
+    email_queue = make_queue(smtp_server(handler))
+
+    status = wait_for(email_queue, submit_report(email_queue))
+
+    assert status["state"] == "sent"
+    assert status["attempts"] == 2
+    assert len(handler.messages) == 1
+
+
+def test_stopped_server_ends_in_failed():
+    controller = Controller(RecordingHandler(), hostname="127.0.0.1", port=free_port())
+    controller.start()
+    email_queue = make_queue(controller, max_attempts=3)
+    controller.stop()
+
+    status = wait_for(email_queue, submit_report(email_queue))
+
+    assert status["state"] == "failed"
+    assert status["attempts"] == 3
+    assert status["error"]
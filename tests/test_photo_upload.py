@@ -0,0 +1,95 @@
+"""Téléversement des photos : chaque photo ne traverse le réseau qu'une fois.
+
+La valeur du composant est simulée comme l'enverrait le navigateur : la photo complète
+(octets en base64) tant que le serveur ne l'a pas reçue, puis son seul identifiant.
+"""
+import base64
+import hashlib
+import io
+import json
+
+from PIL import Image
+
+from report_engine import adopt_prepared_image
+
+
+def jpeg(size=(800, 600), fmt="JPEG", mode="RGB"):
+    buffer = io.BytesIO()
+    Image.new(mode, size, "white").save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def photo(data, name="photo.jpg"):
+    return {"id": hashlib.sha256(data).hexdigest(), "name": name, "type": "image/jpeg",
+            "data": base64.b64encode(data).decode(), "prepared": True, "width": 800, "height": 600}
+
+
+def token(data):
+    return {"id": hashlib.sha256(data).hexdigest()}
+
+
+def received(at, key):
+    # Identifiants que le composant n'enverra plus qu'en jeton
+    for component in at.get("component_instance"):
+        args = json.loads(component.proto.json_args)
+        if args["key"] == key:
+            return args["received"]
+    raise AssertionError(f"composant {key} absent")
+
+
+def test_main_photo_is_sent_once(app):
+    data = jpeg()
+    at = app()
+
+    at.session_state["main_image"] = [photo(data)]
+    at.run()
+    assert received(at, "main_image") == [token(data)["id"]]
+    assert len(at.get("imgs")) == 1
+
+    # Reruns suivants : le navigateur n'envoie plus que l'identifiant, la photo reste affichée
+    at.session_state["main_image"] = [token(data)]
+    at.run()
+    assert not at.exception
+    assert received(at, "main_image") == [token(data)["id"]]
+    assert len(at.get("imgs")) == 1
+
+    # Photo retirée puis ajoutée de nouveau : libérée, puis renvoyée avec ses octets
+    at.session_state["main_image"] = []
+    at.run()
+    assert received(at, "main_image") == []
+    assert len(at.get("imgs")) == 0
+    at.session_state["main_image"] = [token(data)]
+    at.run()
+    assert received(at, "main_image") == []
+    at.session_state["main_image"] = [photo(data)]
+    at.run()
+    assert received(at, "main_image") == [token(data)["id"]]
+
+
+def test_cancelled_edit_form_discards_its_photos(app):
+    at = app()
+    store = at.session_state["photo_store"]
+    at.session_state["observations"] = [{"id": "obs", "type": "✅ Positive", "description": "d",
+                                         "photos": [store.add(jpeg((400, 300)))], "action": ""}]
+    at.run()
+    at.button(key="mod_0").click().run()
+    data = jpeg()
+    at.session_state["edit_photos_0"] = [photo(data)]
+    at.run()
+    assert received(at, "edit_photos_0") == [token(data)["id"]]
+
+    at.button[[button.label for button in at.button].index("Annuler")].click().run()
+    at.button(key="mod_0").click().run()
+
+    # Formulaire rouvert : la photo n'est plus côté serveur, un jeton seul ne suffit plus
+    at.session_state["edit_photos_0"] = [token(data)]
+    at.run()
+    assert received(at, "edit_photos_0") == []
+
+
+def test_prepared_photo_is_checked_before_adoption():
+    assert adopt_prepared_image(jpeg(), 800, 600) is not None
+    assert adopt_prepared_image(jpeg(fmt="PNG"), 800, 600) is None
+    assert adopt_prepared_image(jpeg(), 600, 800) is None
+    assert adopt_prepared_image(jpeg(mode="L"), 800, 600) is None
+    assert adopt_prepared_image(b"pas une image", 800, 600) is None
@@ -0,0 +1,62 @@
+"""File de rendu : la suite du rapport (on_done) s'exécute dans le processus parent, sans session."""
+import threading
+import time
+from datetime import date
+
+import pytest
+
+from render_jobs import RenderJobQueue
+
+VISIT = {
+    "date": date(2024, 3, 18),
+    "address": "12 rue de l'Église",
+    "redacteur": "Elodie BONNAY",
+    "personnes_presentes": "",
+    "arrival_time": "09h00",
+    "departure_time": "10h30",
+    "building_code": "1234",
+}
+
+
+@pytest.fixture(scope="module")
+def render_queue():
+    render_queue = RenderJobQueue(max_workers=1)
+    yield render_queue
+    render_queue.shutdown()
+
+
+def wait_for(render_queue, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = render_queue.status(job_id)
+        if status.get("state") not in ("pending", "running"):
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"tâche toujours {render_queue.status(job_id)}")
+
+
+def test_on_done_runs_before_the_job_is_done(render_queue):
+    calls = []
+
+    def on_done(result):
+        calls.append((threading.current_thread().name, result["pdf"][:5]))
+        return {"message_id": "abc"}
+
+    status = wait_for(render_queue, render_queue.submit(VISIT, None, [], on_done=on_done))
+
+    assert status["state"] == "done"
+    assert status["delivery"] == {"message_id": "abc"}
+    (thread_name, header), = calls
+    assert thread_name.startswith("render-delivery")
+    assert header == b"%PDF-"
+
+
+def test_failed_on_done_keeps_the_pdf(render_queue):
+    def on_done(result):
+        raise RuntimeError("base indisponible")
+
+    status = wait_for(render_queue, render_queue.submit(VISIT, None, [], on_done=on_done))
+
+    assert status["state"] == "done"
+    assert status["error"] == "base indisponible"
+    assert status["result"]["pdf"].startswith(b"%PDF-")
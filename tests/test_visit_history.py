@@ -0,0 +1,53 @@
+"""Historique des rapports : recherche par adresse, sans casse ni accents comme les observations."""
+import sqlite3
+from datetime import date
+
+import pytest
+
+from visit_history import VisitHistory
+
+OBSERVATION = {"type": "❌ A améliorer", "description": "Fissure en façade", "action": ""}
+
+
+def visit(address, building_code="1234"):
+    return {"date": date(2024, 3, 18), "address": address, "redacteur": "Elodie BONNAY",
+            "building_code": building_code}
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = VisitHistory(str(tmp_path / "historique.sqlite"))
+    history.record_visit(visit("12 rue de l'Église, Lyon"), [OBSERVATION], b"%PDF-1.3")
+    history.record_visit(visit("3 place de la Mairie, Villeurbanne", "5678"), [OBSERVATION], b"%PDF-1.3")
+    return history
+
+
+def addresses(rows):
+    return [row["address"] for row in rows]
+
+
+def test_address_ignores_case_and_accents(history):
+    assert addresses(history.search(address="eglise")) == ["12 rue de l'Église, Lyon"]
+    assert addresses(history.search(address="RUE égl")) == ["12 rue de l'Église, Lyon"]
+    assert addresses(history.search(address="villeur")) == ["3 place de la Mairie, Villeurbanne"]
+    assert history.search(address="marseille") == []
+
+
+def test_address_combines_with_observation_text(history):
+    rows = history.search(text="facade", address="mairie")
+
+    assert addresses(rows) == ["3 place de la Mairie, Villeurbanne"]
+    assert "**" in rows[0]["snippet"]
+
+
+def test_existing_base_gets_the_address_index(tmp_path):
+    path = str(tmp_path / "historique.sqlite")
+    VisitHistory(path).record_visit(visit("12 rue de l'Église, Lyon"), [], b"%PDF-1.3")
+    # Base d'avant l'index des adresses : index plein texte vide, schéma en version 0
+    db = sqlite3.connect(path)
+    db.execute("INSERT INTO visits_fts (visits_fts) VALUES ('delete-all')")
+    db.execute("PRAGMA user_version = 0")
+    db.commit()
+    db.close()
+
+    assert addresses(VisitHistory(path).search(address="eglise")) == ["12 rue de l'Église, Lyon"]
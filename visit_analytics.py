@@ -0,0 +1,195 @@
+"""Entrepôt analytique des visites finalisées, en Parquet partitionné par année.
+
+Chaque rapport envoyé ajoute une ligne au jeu ``visits`` (immeuble, rédacteur, durée,
+nombre d'observations) et une ligne par observation au jeu ``observations``. Un fichier
+est écrit par visite dans ``year=AAAA/`` ; au-delà de ANALYTICS_COMPACT_FILES fichiers,
+une partition est réécrite en un seul. Le tableau de bord ne lit que les colonnes et les
+années utiles, et calcule ses agrégats avec des opérations vectorisées pandas.
+"""
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+ANALYTICS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "analytics")
+
+# Fichiers d'une partition au-delà desquels elle est regroupée en un seul
+ANALYTICS_COMPACT_FILES = 16
+
+NEGATIVE_TYPE = "❌ A améliorer"
+
+_VISITS_SCHEMA = pa.schema([
+    ("visit_id", pa.string()),
+    ("visit_date", pa.date32()),
+    ("building_code", pa.string()),
+    ("address", pa.string()),
+    ("redacteur", pa.string()),
+    ("arrival_time", pa.string()),
+    ("departure_time", pa.string()),
+    ("duration_min", pa.float64()),
+    ("observations", pa.int32()),
+    ("negatives", pa.int32()),
+    ("recorded_at", pa.timestamp("s")),
+])
+
+_OBSERVATIONS_SCHEMA = pa.schema([
+    ("visit_id", pa.string()),
+    ("visit_date", pa.date32()),
+    ("building_code", pa.string()),
+    ("redacteur", pa.string()),
+    ("position", pa.int32()),
+    ("type", pa.string()),
+    ("negative", pa.bool_()),
+    ("action", pa.string()),
+])
+
+_SCHEMAS = {"visits": _VISITS_SCHEMA, "observations": _OBSERVATIONS_SCHEMA}
+_PARTITIONING = ds.partitioning(pa.schema([("year", pa.int16())]), flavor="hive")
+
+# Partagé par toutes les instances du processus (application et pages) : un regroupement
+# en cours ne doit jamais être vu à moitié par une lecture
+_lock = threading.Lock()
+
+
+def clock_minutes(values):
+    # "09h00", "9h", "9 h 30", "09:30" -> minutes depuis minuit ; NaN si illisible
+    parts = pd.Series(values, dtype="string").str.extract(r"^\s*(\d{1,2})\s*[hH:]\s*(\d{2})?\s*$")
+    hours = pd.to_numeric(parts[0]).astype("float64")
+    minutes = pd.to_numeric(parts[1]).astype("float64").fillna(0)
+    return (hours * 60 + minutes).where((hours < 24) & (minutes < 60))
+
+
+def visit_duration_minutes(arrival, departure):
+    duration = clock_minutes(departure) - clock_minutes(arrival)
+    return duration.where(duration > 0)
+
+
+class VisitAnalytics:
+    def __init__(self, path=ANALYTICS_PATH, compact_files=ANALYTICS_COMPACT_FILES):
+        self.path = path
+        self.compact_files = compact_files
+
+    def record_visit(self, data, observations):
+        visit_id = uuid.uuid4().hex
+        visit_date = pd.Timestamp(data["date"]).date()
+        arrival, departure = data.get("arrival_time") or "", data.get("departure_time") or ""
+        duration = visit_duration_minutes([arrival], [departure]).iloc[0]
+        negatives = [obs.get("type") == NEGATIVE_TYPE for obs in observations]
+        common = {"visit_id": visit_id, "visit_date": visit_date,
+                  "building_code": str(data.get("building_code") or ""), "redacteur": data.get("redacteur") or ""}
+        visit = dict(common, address=data.get("address") or "", arrival_time=arrival, departure_time=departure,
+                     duration_min=None if pd.isna(duration) else float(duration),
+                     observations=len(observations), negatives=sum(negatives),
+                     recorded_at=pd.Timestamp.now().floor("s").to_pydatetime())
+        rows = [dict(common, position=position, type=obs.get("type") or "", negative=negative,
+                     action=obs.get("action") or "")
+                for position, (obs, negative) in enumerate(zip(observations, negatives))]
+        with _lock:
+            self._append("visits", [visit], visit_date.year)
+            if rows:
+                self._append("observations", rows, visit_date.year)
+        return visit_id
+
+    def _partition_dir(self, name, year):
+        return os.path.join(self.path, name, f"year={year}")
+
+    def _append(self, name, rows, year):
+        # Appelé avec _lock acquis ; fichier temporaire préfixé par "." ignoré des lectures
+        directory = self._partition_dir(name, year)
+        os.makedirs(directory, exist_ok=True)
+        file_name = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        tmp_path = os.path.join(directory, "." + file_name)
+        pq.write_table(pa.Table.from_pylist(rows, schema=_SCHEMAS[name]), tmp_path)
+        os.replace(tmp_path, os.path.join(directory, file_name))
+        files = self._files(directory)
+        if len(files) > self.compact_files:
+            self._compact(name, directory, files)
+
+    def _files(self, directory):
+        return sorted(entry.path for entry in os.scandir(directory)
+                      if entry.name.endswith(".parquet") and not entry.name.startswith("."))
+
+    def _compact(self, name, directory, files):
+        # Appelé avec _lock acquis : une partition = un fichier, trié par date
+        table = pq.read_table(files, schema=_SCHEMAS[name]).sort_by([("visit_date", "ascending")])
+        file_name = f"compact-{uuid.uuid4().hex[:8]}.parquet"
+        tmp_path = os.path.join(directory, "." + file_name)
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, os.path.join(directory, file_name))
+        for path in files:
+            os.remove(path)
+
+    def version(self):
+        # Change à chaque ajout ou regroupement : clé d'invalidation des agrégats en cache
+        latest, count = 0, 0
+        for name in _SCHEMAS:
+            root = os.path.join(self.path, name)
+            if not os.path.isdir(root):
+                continue
+            for partition in os.scandir(root):
+                if partition.is_dir():
+                    latest = max(latest, partition.stat().st_mtime_ns)
+                    count += len(self._files(partition.path))
+        return latest, count
+
+    def load(self, name, columns=None, date_from=None, date_to=None):
+        # Seules les colonnes demandées et les années de la période sont lues
+        schema = _SCHEMAS[name]
+        root = os.path.join(self.path, name)
+        columns = list(columns or schema.names)
+        conditions = []
+        if date_from is not None:
+            date_from = pd.Timestamp(date_from).date()
+            conditions += [ds.field("year") >= date_from.year, ds.field("visit_date") >= date_from]
+        if date_to is not None:
+            date_to = pd.Timestamp(date_to).date()
+            conditions += [ds.field("year") <= date_to.year, ds.field("visit_date") <= date_to]
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        with _lock:
+            if not os.path.isdir(root):
+                table = schema.empty_table().select(columns)
+            else:
+                dataset = ds.dataset(root, schema=schema.append(pa.field("year", pa.int16())),
+                                     format="parquet", partitioning=_PARTITIONING)
+                table = dataset.to_table(columns=columns, filter=expression)
+        return table.to_pandas(date_as_object=False)
+
+
+def negative_share_by_building(observations, freq="M"):
+    # Part des observations "à améliorer" par immeuble et par période
+    period = observations["visit_date"].dt.to_period(freq).dt.to_timestamp()
+    grouped = observations.groupby([observations["building_code"], period.rename("period")])["negative"]
+    return grouped.agg(share="mean", observations="size").reset_index()
+
+
+def recurring_actions(observations, top=20):
+    # Actions regroupées sans tenir compte de la casse, des espaces ni de la ponctuation finale
+    normalized = (observations["action"].str.lower().str.strip()
+                  .str.replace(r"\s+", " ", regex=True).str.rstrip(" .!"))
+    actions = observations.assign(action=normalized)[normalized != ""]
+    summary = actions.groupby("action").agg(
+        occurrences=("visit_id", "size"),
+        buildings=("building_code", "nunique"),
+        last_seen=("visit_date", "max"),
+    )
+    return summary.sort_values(["occurrences", "last_seen"], ascending=False).head(top).reset_index()
+
+
+def visit_durations(visits, freq="M"):
+    # Durée médiane et moyenne des visites (minutes) par période
+    timed = visits.dropna(subset=["duration_min"])
+    period = timed["visit_date"].dt.to_period(freq).dt.to_timestamp()
+    return timed.groupby(period.rename("period"))["duration_min"].agg(["median", "mean", "count"])
+
+
+def visits_per_redacteur(visits, freq="M"):
+    # Nombre de visites par période (lignes) et par rédacteur (colonnes)
+    period = visits["visit_date"].dt.to_period(freq).dt.to_timestamp()
+    return pd.crosstab(period.rename("period"), visits["redacteur"]).rename_axis(columns=None)
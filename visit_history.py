@@ -0,0 +1,176 @@
+"""Historique des rapports générés, consultable et recherchable.
+
+Chaque rapport est enregistré dans une base SQLite : les informations de la visite
+(indexées par code immeuble, date et rédacteur, et en plein texte FTS5 pour l'adresse), ses
+observations avec un index plein texte sur leur type, description et action, le PDF et des
+vignettes des photos. Les deux recherches plein texte ignorent casse et accents.
+Les PDF et vignettes sont dans des tables séparées : les recherches ne lisent jamais de blobs.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+VISIT_HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "historique.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS visits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    visit_date TEXT NOT NULL,
+    building_code TEXT NOT NULL,
+    address TEXT NOT NULL COLLATE NOCASE,
+    redacteur TEXT NOT NULL,
+    personnes_presentes TEXT,
+    arrival_time TEXT,
+    departure_time TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS visits_building_code ON visits (building_code, visit_date);
+CREATE INDEX IF NOT EXISTS visits_date ON visits (visit_date);
+CREATE INDEX IF NOT EXISTS visits_redacteur ON visits (redacteur, visit_date);
+CREATE VIRTUAL TABLE IF NOT EXISTS visits_fts USING fts5 (
+    address,
+    content='visits', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS observations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    visit_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT,
+    description TEXT,
+    action TEXT
+);
+CREATE INDEX IF NOT EXISTS observations_visit ON observations (visit_id, position);
+CREATE VIRTUAL TABLE IF NOT EXISTS observations_fts USING fts5 (
+    type, description, action,
+    content='observations', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS reports (
+    visit_id INTEGER PRIMARY KEY,
+    pdf BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    visit_id INTEGER NOT NULL,
+    observation INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (visit_id, observation, position)
+);
+"""
+
+# Version du schéma (PRAGMA user_version) : 1 = adresse indexée dans visits_fts
+_SCHEMA_VERSION = 1
+
+_VISIT_COLUMNS = ("visit_date", "building_code", "address", "redacteur",
+                  "personnes_presentes", "arrival_time", "departure_time")
+
+
+def _match_query(text):
+    # Chaque mot devient un préfixe entre guillemets : pas d'opérateurs FTS5 involontaires
+    terms = [term.replace('"', '""') for term in text.split()]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+class VisitHistory:
+    def __init__(self, path=VISIT_HISTORY_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+            # Base créée avant l'index plein texte des adresses : il est construit depuis visits
+            with self._db:
+                self._db.execute("DROP INDEX IF EXISTS visits_address")
+                self._db.execute("INSERT INTO visits_fts (visits_fts) VALUES ('rebuild')")
+                self._db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self._lock = threading.Lock()
+
+    def record_visit(self, data, observations, pdf_bytes, thumbnails=()):
+        # thumbnails : (numéro d'observation, -1 pour la photo principale ; position ; JPEG)
+        values = dict(data, visit_date=str(data["date"]))
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                f"INSERT INTO visits ({', '.join(_VISIT_COLUMNS)}, created_at) "
+                f"VALUES ({', '.join('?' * len(_VISIT_COLUMNS))}, ?)",
+                [str(values.get(column) or "") for column in _VISIT_COLUMNS] + [time.time()],
+            )
+            visit_id = cursor.lastrowid
+            self._db.execute("INSERT INTO visits_fts (rowid, address) VALUES (?, ?)",
+                             (visit_id, str(values.get("address") or "")))
+            for position, obs in enumerate(observations):
+                row = (obs.get("type", ""), obs.get("description", ""), obs.get("action", ""))
+                obs_id = self._db.execute(
+                    "INSERT INTO observations (visit_id, position, type, description, action) "
+                    "VALUES (?, ?, ?, ?, ?)", (visit_id, position) + row,
+                ).lastrowid
+                self._db.execute(
+                    "INSERT INTO observations_fts (rowid, type, description, action) VALUES (?, ?, ?, ?)",
+                    (obs_id,) + row,
+                )
+            self._db.execute("INSERT INTO reports (visit_id, pdf) VALUES (?, ?)", (visit_id, pdf_bytes))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO thumbnails (visit_id, observation, position, data) VALUES (?, ?, ?, ?)",
+                [(visit_id, observation, position, thumbnail) for observation, position, thumbnail in thumbnails],
+            )
+        return visit_id
+
+    def search(self, text=None, building_code=None, address=None, redacteur=None,
+               date_from=None, date_to=None, limit=50):
+        # Sans texte : visites les plus récentes correspondant aux filtres.
+        # Avec texte : une ligne par observation trouvée, avec un extrait surligné.
+        filters, params = [], []
+        if building_code:
+            filters.append("v.building_code = ?")
+            params.append(str(building_code))
+        if address and address.strip():
+            # Mots de l'adresse en préfixe, sans casse ni accents : "eglise" trouve "Église"
+            filters.append("v.id IN (SELECT rowid FROM visits_fts WHERE visits_fts MATCH ?)")
+            params.append(_match_query(address))
+        if redacteur:
+            filters.append("v.redacteur = ?")
+            params.append(redacteur)
+        if date_from:
+            filters.append("v.visit_date >= ?")
+            params.append(str(date_from))
+        if date_to:
+            filters.append("v.visit_date <= ?")
+            params.append(str(date_to))
+        columns = "v.id, v.visit_date, v.building_code, v.address, v.redacteur"
+        if text and text.strip():
+            where = " AND ".join(["observations_fts MATCH ?"] + filters)
+            query = (
+                f"SELECT {columns}, o.position, o.type, "
+                "snippet(observations_fts, -1, '**', '**', '…', 16) AS snippet "
+                "FROM observations_fts "
+                "JOIN observations o ON o.id = observations_fts.rowid "
+                "JOIN visits v ON v.id = o.visit_id "
+                f"WHERE {where} ORDER BY v.visit_date DESC, v.id DESC, o.position LIMIT ?"
+            )
+            params = [_match_query(text)] + params
+        else:
+            where = " AND ".join(filters) or "1"
+            query = f"SELECT {columns} FROM visits v WHERE {where} ORDER BY v.visit_date DESC, v.id DESC LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(query, params + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    def redacteurs(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT redacteur FROM visits ORDER BY redacteur")]
+
+    def get_thumbnails(self, visit_id):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT observation, data FROM thumbnails WHERE visit_id = ? ORDER BY observation, position",
+                (visit_id,),
+            ).fetchall()
+        return [(row["observation"], row["data"]) for row in rows]
+
+    def get_pdf(self, visit_id):
+        with self._lock:
+            row = self._db.execute("SELECT pdf FROM reports WHERE visit_id = ?", (visit_id,)).fetchone()
+        return row[0] if row else None